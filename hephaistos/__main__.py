@@ -13,7 +13,12 @@ See README for usage examples or run:
 - `python -m hephaistos` directly to enter interactive mode.
 - `python -m hephaistos --help` for more information about the CLI commands.
 """
+import multiprocessing
+
 from hephaistos.cli import Hephaistos
 
 
-Hephaistos()
+if __name__ == '__main__':
+    # required for worker processes when running from PyInstaller executables
+    multiprocessing.freeze_support()
+    Hephaistos()
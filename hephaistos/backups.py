@@ -1,47 +1,491 @@
-from distutils import dir_util, file_util
+import contextlib
+from distutils import dir_util
+from enum import Enum
+import json
+import mmap
+import os
 from pathlib import Path
+import shutil
+import threading
+from typing import Generator
+import zipfile
 
-from hephaistos import config, sjson_data
+from hephaistos import config, hashes, helpers
 from hephaistos.config import LOGGER
 
 
+# backups are named after the SHA-256 of original files, so that identical
+# originals are stored once, even across installations sharing a store (see
+# '--backup-store'), which track their users so as to discard unused backups
+MANIFEST_VERSION = 1
+OBJECTS_DIR = 'objects'
+REFERENCES_FILE = 'references.json'
+# Backups may instead be compressed into a single archive per store (see
+# '--backup-compression'), in which case backups are extracted to a temporary
+# file when needed, which must be released once done with it. ZIP archives are
+# indexed per member, so that only the needed backup is decompressed.
+ARCHIVE_FILE = 'backups.zip'
+
+
+class BackupCompression(str, Enum):
+    NONE = 'none'
+    ZLIB = 'zlib'
+    LZMA = 'lzma'
+
+
+COMPRESSION_TYPES = {
+    BackupCompression.ZLIB: zipfile.ZIP_DEFLATED,
+    BackupCompression.LZMA: zipfile.ZIP_LZMA,
+}
+
+
 def get(file: Path) -> Path:
-    backup_file = __get_file(file)
+    entry = __load_manifest().get(__get_key(file))
+    if entry is None:
+        # fall back to backups stored by previous Hephaistos versions
+        backup_file = __get_legacy_file(file)
+    elif 'delta' in entry:
+        backup_file = __rebuild_from_delta(file, entry)
+    elif entry.get('compression', BackupCompression.NONE) != BackupCompression.NONE:
+        backup_file = __get_temporary_file(entry['sha256'])
+        with __open_archive(Path(entry['store'])) as archive:
+            try:
+                with archive.open(entry['sha256']) as source, backup_file.open('wb') as destination:
+                    shutil.copyfileobj(source, destination)
+            except KeyError:
+                backup_file.unlink(missing_ok=True)
+                raise LookupError(f"Backup file for '{file}' is missing from '{archive.filename}'")
+        hashes.forget(backup_file)
+        LOGGER.debug(f"Extracted backup for '{file}' from '{archive.filename}' to '{backup_file}'")
+    else:
+        backup_file = __get_object_file(Path(entry['store']), entry['sha256'])
     if not backup_file.exists():
         raise LookupError(f"Backup file '{backup_file}' is missing")
-    # also dispatch to `sjson_data` if retrieving an SJSON file
-    source_sjson = sjson_data.get(file) if file.suffix == config.SJSON_SUFFIX else None
-    return backup_file, source_sjson
+    return backup_file
+
+
+def store(file: Path, delta: bool=False) -> Path:
+    """Store a backup of `file`. If `delta` is True, `update` must be called
+    once `file` is patched, to replace the backup with a delta backup."""
+    key = __get_key(file)
+    legacy_file = __get_legacy_file(file)
+    previous_entry = __load_manifest().get(key)
+    if (previous_entry is not None or legacy_file.exists()) and not config.force:
+        raise FileExistsError(f"Backup file for '{file}' already exists")
+    # delta backups start as a full copy in the local store, which is removed
+    # once replaced with the delta backup
+    backup_store = config.BACKUP_DIR if delta else __get_store()
+    backup_compression = BackupCompression.NONE if delta else config.backup_compression
+    sha256 = hashes.digest(file)
+    # backup is referenced in manifest before being stored, so that it cannot
+    # be discarded as unused in-between (see `__discard_unused_object`)
+    entry = {'sha256': sha256, 'size': file.stat().st_size, 'store': str(backup_store), 'compression': backup_compression}
+    helpers.update_manifest(config.BACKUPS_FILE, MANIFEST_VERSION, {key: entry})
+    if backup_store != config.BACKUP_DIR:
+        __add_reference(backup_store, sha256)
+    if backup_compression != BackupCompression.NONE:
+        # file will be patched in place: keep a copy of the original as basis
+        backup_file = __get_temporary_file(sha256)
+        helpers.copy_file(file, backup_file)
+        hashes.forget(backup_file)
+        with __open_archive(backup_store, 'a') as archive:
+            if sha256 in archive.namelist():
+                LOGGER.debug(f"Found identical backup for '{file}' in '{archive.filename}'")
+            else:
+                archive.write(backup_file, sha256, compress_type=COMPRESSION_TYPES[backup_compression])
+                LOGGER.debug(f"Compressed backup for '{file}' into '{archive.filename}'")
+    else:
+        backup_file = __get_object_file(backup_store, sha256)
+        if backup_file.exists():
+            LOGGER.debug(f"Found identical backup for '{file}' at '{backup_file}'")
+        else:
+            backup_file.parent.mkdir(parents=True, exist_ok=True)
+            # other processes may be storing the same file in a shared store
+            temporary_file = backup_file.with_name(f'{sha256}.{os.getpid()}-{threading.get_ident()}.tmp')
+            helpers.copy_file(file, temporary_file)
+            os.replace(temporary_file, backup_file)
+    if legacy_file.exists():
+        legacy_file.unlink()
+    if previous_entry is not None:
+        __discard_unused_object(previous_entry)
+    LOGGER.debug(f"Backed up '{file}' to '{backup_store}'")
+    return backup_file
+
+
+def update(file: Path, backup_file: Path, patched_file: Path=None) -> None:
+    """Replace backup of `file` with a delta of the original bytes changed when
+    patching it (or `patched_file`, if not in place yet) from `backup_file`."""
+    patched_file = patched_file or file
+    key = __get_key(file)
+    entries = __load_manifest()
+    sha256 = entries[key]['sha256'] if key in entries else hashes.digest(backup_file)
+    if patched_file.stat().st_size != backup_file.stat().st_size:
+        LOGGER.debug(f"Patched '{file}' has a different size than its backup: keeping full backup")
+        return
+    with patched_file.open('rb') as patched_handle, backup_file.open('rb') as original_handle, \
+        mmap.mmap(patched_handle.fileno(), 0, access=mmap.ACCESS_READ) as patched, \
+        mmap.mmap(original_handle.fileno(), 0, access=mmap.ACCESS_READ) as original:
+        delta = [[offset, original[offset:end].hex()] for offset, end in __diff(original, patched)]
+    entry = {'sha256': sha256, 'size': backup_file.stat().st_size, 'patched_sha256': hashes.digest(patched_file), 'delta': delta}
+    helpers.update_manifest(config.BACKUPS_FILE, MANIFEST_VERSION, {key: entry})
+    LOGGER.debug(f"Replaced backup of '{file}' with a delta backup ({len(delta)} changes)")
+    legacy_file = __get_legacy_file(file)
+    if legacy_file.exists():
+        legacy_file.unlink()
+    # full copy is not needed anymore, unless used by another local backup
+    if backup_file == __get_object_file(config.BACKUP_DIR, sha256):
+        __discard_unused_object({'sha256': sha256, 'store': str(config.BACKUP_DIR)})
+
+
+def __discard_unused_object(entry: dict) -> None:
+    if 'store' not in entry:
+        return
+    backup_store = Path(entry['store'])
+    compressed = entry.get('compression', BackupCompression.NONE) != BackupCompression.NONE
+    # hold manifest locks so that backups cannot be referenced meanwhile
+    with helpers.file_lock(config.BACKUPS_FILE.with_suffix('.lock')):
+        entries = __load_manifest()
+        if any(other.get('sha256') == entry['sha256'] and other.get('store') == entry['store'] for other in entries.values()):
+            return
+        discard = __discard_archive_member if compressed else __discard_object
+        if backup_store == config.BACKUP_DIR:
+            discard(backup_store, entry['sha256'])
+            return
+        with helpers.file_lock(backup_store.joinpath(REFERENCES_FILE).with_suffix('.lock')):
+            if __remove_reference(backup_store, entry['sha256']):
+                discard(backup_store, entry['sha256'])
+
+
+def __discard_object(backup_store: Path, sha256: str) -> None:
+    object_file = __get_object_file(backup_store, sha256)
+    object_file.unlink(missing_ok=True)
+    with contextlib.suppress(OSError):
+        object_file.parent.rmdir()
+    LOGGER.debug(f"Discarded unused backup '{object_file}'")
+
+
+def __discard_archive_member(backup_store: Path, sha256: str) -> None:
+    # members cannot be removed from ZIP archives: the archive is rewritten
+    # without it instead, which only happens when original files changed
+    archive_file = backup_store.joinpath(ARCHIVE_FILE)
+    if not archive_file.exists():
+        return
+    temporary_file = archive_file.with_name(f'{ARCHIVE_FILE}.{os.getpid()}-{threading.get_ident()}.tmp')
+    with helpers.file_lock(archive_file.with_suffix('.lock')):
+        try:
+            with zipfile.ZipFile(archive_file) as archive:
+                members = [member for member in archive.infolist() if member.filename != sha256]
+                if len(members) == len(archive.infolist()):
+                    return
+                if members:
+                    with zipfile.ZipFile(temporary_file, 'w') as new_archive:
+                        for member in members:
+                            with archive.open(member) as source, new_archive.open(member, 'w') as destination:
+                                shutil.copyfileobj(source, destination)
+        except BaseException:
+            temporary_file.unlink(missing_ok=True)
+            raise
+        if members:
+            os.replace(temporary_file, archive_file)
+        else:
+            archive_file.unlink()
+    LOGGER.debug(f"Discarded unused backup '{sha256}' from '{archive_file}'")
+
+
+def __get_installation() -> str:
+    return str(config.hades_dir.resolve())
+
+
+def __add_reference(backup_store: Path, sha256: str) -> None:
+    references_file = backup_store.joinpath(REFERENCES_FILE)
+    with helpers.file_lock(references_file.with_suffix('.lock')):
+        references = helpers.load_manifest(references_file, MANIFEST_VERSION)
+        installations = references.setdefault(sha256, {'installations': []})['installations']
+        if __get_installation() not in installations:
+            installations.append(__get_installation())
+            helpers.write_atomically(references_file, json.dumps({'version': MANIFEST_VERSION, 'files': references}, indent=2).encode())
+
+
+def __remove_reference(backup_store: Path, sha256: str) -> bool:
+    """Remove reference from this installation to backup `sha256` in shared
+    `backup_store` (lock must be held), and return True if it is now unused.
+    Backups stored without references are kept, as they may be used by any
+    installation."""
+    references_file = backup_store.joinpath(REFERENCES_FILE)
+    references = helpers.load_manifest(references_file, MANIFEST_VERSION)
+    if sha256 not in references:
+        return False
+    installations = [installation for installation in references[sha256]['installations'] if installation != __get_installation()]
+    if installations:
+        references[sha256]['installations'] = installations
+    else:
+        del references[sha256]
+    helpers.write_atomically(references_file, json.dumps({'version': MANIFEST_VERSION, 'files': references}, indent=2).encode())
+    if installations:
+        LOGGER.debug(f"Kept backup '{sha256}' in '{backup_store}' as it is used by other installations")
+    return not installations
+
+
+# files are compared in chunks rather than in full, so that memory usage does
+# not grow with file size, and byte-wise comparison is only used on small
+# ranges, larger differing ranges being bisected first
+DIFF_CHUNK_SIZE = 1024 * 1024
+DIFF_BISECT_SIZE = 64
+
+
+def __diff(original: mmap.mmap, patched: mmap.mmap) -> list[tuple[int, int]]:
+    """Return ranges differing between `original` and `patched`, with adjacent
+    ranges merged."""
+    ranges = []
+    for start in range(0, len(original), DIFF_CHUNK_SIZE):
+        end = min(start + DIFF_CHUNK_SIZE, len(original))
+        if original[start:end] != patched[start:end]:
+            __merge_ranges(ranges, __bisect(original, patched, start, end))
+    return ranges
+
+
+def __bisect(original: mmap.mmap, patched: mmap.mmap, start: int, end: int) -> list[tuple[int, int]]:
+    if original[start:end] == patched[start:end]:
+        return []
+    if end - start <= DIFF_BISECT_SIZE:
+        ranges = []
+        for offset in range(start, end):
+            if original[offset] != patched[offset]:
+                __merge_ranges(ranges, [(offset, offset + 1)])
+        return ranges
+    middle = (start + end) // 2
+    ranges = __bisect(original, patched, start, middle)
+    __merge_ranges(ranges, __bisect(original, patched, middle, end))
+    return ranges
+
+
+def __merge_ranges(ranges: list[tuple[int, int]], other_ranges: list[tuple[int, int]]) -> None:
+    for range_start, range_end in other_ranges:
+        if ranges and ranges[-1][1] == range_start:
+            ranges[-1] = (ranges[-1][0], range_end)
+        else:
+            ranges.append((range_start, range_end))
 
 
-def store(file: Path) -> Path:
-    backup_file = __get_file(file)
-    if backup_file.exists() and not config.force:
-        raise FileExistsError(f"Backup file '{backup_file}' already exists")
-    backup_file.parent.mkdir(parents=True, exist_ok=True)
-    file_util.copy_file(str(file), str(backup_file))
-    LOGGER.debug(f"Backed up '{file}' to '{backup_file}'")
-    # also dispatch to `sjson_data` if storing an SJSON file
-    source_sjson = sjson_data.store(file) if file.suffix == config.SJSON_SUFFIX else None
-    return backup_file, source_sjson
+def __rebuild_from_delta(file: Path, entry: dict) -> Path:
+    if not file.exists():
+        raise LookupError(f"Backup file for '{file}' cannot be rebuilt from its delta backup: '{file}' is missing")
+    backup_file = __get_temporary_file(entry['sha256'])
+    helpers.copy_file(file, backup_file)
+    with backup_file.open('r+b') as backup_handle:
+        for offset, original_bytes in entry['delta']:
+            backup_handle.seek(offset)
+            backup_handle.write(bytes.fromhex(original_bytes))
+        backup_handle.truncate(entry['size'])
+    hashes.forget(backup_file)
+    if hashes.digest(backup_file) != entry['sha256']:
+        backup_file.unlink()
+        raise LookupError(f"Backup file for '{file}' cannot be rebuilt from its delta backup: '{file}' was modified")
+    LOGGER.debug(f"Rebuilt backup for '{file}' from its delta backup to '{backup_file}'")
+    return backup_file
 
 
-def __get_file(file: Path) -> Path:
-    config.BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+def exists(file: Path) -> bool:
+    """Check if a backup exists for `file`, without extracting it."""
+    entry = __load_manifest().get(__get_key(file))
+    if entry is None:
+        return __get_legacy_file(file).exists()
+    if 'delta' in entry:
+        return True
+    if entry.get('compression', BackupCompression.NONE) != BackupCompression.NONE:
+        try:
+            with __open_archive(Path(entry['store'])) as archive:
+                return entry['sha256'] in archive.namelist()
+        except LookupError:
+            return False
+    return __get_object_file(Path(entry['store']), entry['sha256']).exists()
+
+
+def digest(file: Path) -> str:
+    """Return SHA-256 of the original `file` that was backed up."""
+    entry = __load_manifest().get(__get_key(file))
+    if entry is None:
+        return hashes.digest(__get_legacy_file(file))
+    return entry['sha256']
+
+
+def is_delta(file: Path) -> bool:
+    """Check if backup of `file` is a delta backup (see `update`)."""
+    return 'delta' in __load_manifest().get(__get_key(file), {})
+
+
+def release(backup_file: Path) -> None:
+    """Release `backup_file` previously returned by `get` or `store` once done
+    with it, removing it if it was extracted from an archive."""
+    if config.BACKUP_TEMP_DIR in backup_file.parents:
+        backup_file.unlink(missing_ok=True)
+
+
+def __get_temporary_file(sha256: str) -> Path:
+    config.BACKUP_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    return config.BACKUP_TEMP_DIR.joinpath(f'{sha256}.{os.getpid()}-{threading.get_ident()}')
+
+
+@contextlib.contextmanager
+def __open_archive(backup_store: Path, mode: str='r') -> Generator[zipfile.ZipFile, None, None]:
+    # worker processes may append to the same archive concurrently
+    archive_file = backup_store.joinpath(ARCHIVE_FILE)
+    if mode == 'r' and not archive_file.exists():
+        raise LookupError(f"Backup archive '{archive_file}' is missing")
+    with helpers.file_lock(archive_file.with_suffix('.lock')), zipfile.ZipFile(archive_file, mode) as archive:
+        yield archive
+
+
+def __get_store() -> Path:
+    # shared stores are recorded as absolute paths, so that they can be found
+    # from the manifest no matter the working directory
+    return config.backup_store.resolve() if config.backup_store else config.BACKUP_DIR
+
+
+def __get_object_file(backup_store: Path, sha256: str) -> Path:
+    return backup_store.joinpath(OBJECTS_DIR, sha256[:2], sha256)
+
+
+def __get_key(file: Path) -> str:
+    return file.relative_to(config.hades_dir).as_posix()
+
+
+def __load_manifest() -> dict[str, dict]:
+    return helpers.load_manifest(config.BACKUPS_FILE, MANIFEST_VERSION)
+
+
+def __get_legacy_file(file: Path) -> Path:
     return config.BACKUP_DIR.joinpath(file.relative_to(config.hades_dir))
 
 
+def __get_legacy_files() -> list[Path]:
+    if not config.BACKUP_DIR.exists():
+        return []
+    objects_dir = config.BACKUP_DIR.joinpath(OBJECTS_DIR)
+    return [
+        file for file in config.BACKUP_DIR.rglob('*')
+        if file.is_file() and objects_dir not in file.parents
+    ]
+
+
+class RestoreAction(str, Enum):
+    RESTORE = 'restored'
+    SKIP = 'skipped'
+    MISMATCH = 'mismatched'
+    FAIL = 'failed'
+
+
 def restore() -> None:
-    if config.BACKUP_DIR.exists():
-        dir_util.copy_tree(str(config.BACKUP_DIR), str(config.hades_dir))
-        dir_util.remove_tree(str(config.BACKUP_DIR))
-        LOGGER.info(f"Restored backups from '{config.BACKUP_DIR}' to '{config.hades_dir}'")
-    else:
+    """Restore backups of files that were patched, skipping files that are
+    already identical to their backup, and leaving alone files that were
+    modified since they were patched (e.g. by a game update)."""
+    entries = __load_manifest()
+    legacy_files = __get_legacy_files()
+    if not entries and not legacy_files:
         LOGGER.info(f"No backups to restore from '{config.BACKUP_DIR}'")
+        return
+    files = [config.hades_dir.joinpath(key) for key in entries]
+    files += [config.hades_dir.joinpath(legacy_file.relative_to(config.BACKUP_DIR)) for legacy_file in legacy_files]
+    sha256s = [entry.get('sha256') for entry in entries.values()] + [None] * len(legacy_files)
+    # files to check may need to be hashed, which is done concurrently
+    actions = helpers.run_concurrently(__get_restore_action, zip(files, sha256s))
+    # full copies of backups may be moved into place rather than copied, as
+    # long as they are only used once in the local store
+    local_objects = [
+        __get_object_file(config.BACKUP_DIR, entry['sha256']) for entry in entries.values()
+        if entry.get('store') == str(config.BACKUP_DIR) and entry.get('compression', BackupCompression.NONE) == BackupCompression.NONE
+    ]
+    movable = {object_file for object_file in local_objects if local_objects.count(object_file) == 1} | set(legacy_files)
+    report = {action: [] for action in RestoreAction}
+    for file, action in zip(files, actions):
+        if action == RestoreAction.RESTORE:
+            try:
+                backup_file = get(file)
+                try:
+                    __move_into_place(backup_file, file, backup_file in movable or config.BACKUP_TEMP_DIR in backup_file.parents)
+                finally:
+                    release(backup_file)
+                LOGGER.info(f"Restored '{file}'")
+            except (LookupError, OSError) as e:
+                LOGGER.warning(f"Did not restore '{file}': {e}")
+                action = RestoreAction.FAIL
+        elif action == RestoreAction.SKIP:
+            LOGGER.info(f"Skipped '{file}': already identical to its backup")
+        else:
+            LOGGER.warning(f"Did not restore '{file}': it was modified since it was patched (e.g. by a game update)")
+        report[action].append(file)
+    shared_stores = {entry['store'] for entry in entries.values() if 'store' in entry} - {str(config.BACKUP_DIR)}
+    failed_files = report[RestoreAction.FAIL]
+    __discard_all_but(entries, legacy_files, failed_files)
+    if failed_files:
+        LOGGER.warning(f"Kept backups of {len(failed_files)} files that could not be restored at '{config.BACKUP_DIR}'")
+    else:
+        for file in [config.BACKUPS_FILE, config.BACKUPS_FILE.with_suffix('.lock')]:
+            if file.exists():
+                file.unlink()
+        if config.BACKUP_DIR.exists():
+            dir_util.remove_tree(str(config.BACKUP_DIR))
+    if config.BACKUP_TEMP_DIR.exists():
+        dir_util.remove_tree(str(config.BACKUP_TEMP_DIR))
+    summary = ', '.join(f"{len(action_files)} {action.value}" for action, action_files in report.items())
+    LOGGER.info(f"Restored backups from '{config.BACKUP_DIR}' to '{config.hades_dir}' ({summary})")
+    # backups in shared stores may also be used by other installations
+    for shared_store in sorted(shared_stores):
+        LOGGER.info(f"Kept backups at '{shared_store}' still used by other installations")
+
+
+def __discard_all_but(entries: dict[str, dict], legacy_files: list[Path], kept_files: list[Path]) -> None:
+    kept_keys = {__get_key(file) for file in kept_files}
+    discarded_entries = {key: entry for key, entry in entries.items() if key not in kept_keys}
+    if discarded_entries:
+        helpers.update_manifest(config.BACKUPS_FILE, MANIFEST_VERSION, {}, removed=discarded_entries)
+    for entry in discarded_entries.values():
+        __discard_unused_object(entry)
+    for legacy_file in legacy_files:
+        if legacy_file.relative_to(config.BACKUP_DIR).as_posix() not in kept_keys:
+            legacy_file.unlink(missing_ok=True)
+
+
+def __get_restore_action(file: Path, sha256: str) -> RestoreAction:
+    if not file.exists():
+        return RestoreAction.RESTORE
+    try:
+        if hashes.check(file):
+            return RestoreAction.RESTORE
+        modified = False
+    except hashes.HashMismatch:
+        modified = True
+    # no stored hash (e.g. if patching was interrupted) or not matching: file
+    # may be identical to its backup already (e.g. after verifying game files)
+    if sha256 is None:
+        sha256 = hashes.digest(__get_legacy_file(file))
+    if hashes.digest(file) == sha256:
+        return RestoreAction.SKIP
+    return RestoreAction.MISMATCH if modified else RestoreAction.RESTORE
+
+
+def __move_into_place(backup_file: Path, file: Path, movable: bool) -> None:
+    # files are replaced with a rename, so that they are never left partially
+    # written, and backups are moved rather than copied whenever possible
+    if movable:
+        try:
+            os.replace(backup_file, file)
+            hashes.forget(file)
+            return
+        except OSError as e:
+            LOGGER.debug(f"Could not move '{backup_file}' to '{file}', copying instead: {e}")
+    temporary_file = file.with_name(f'{file.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+    try:
+        helpers.copy_file(backup_file, temporary_file)
+        os.replace(temporary_file, file)
+    except BaseException:
+        temporary_file.unlink(missing_ok=True)
+        raise
+    hashes.forget(file)
 
 
 def status() -> None:
-    if config.BACKUP_DIR.exists() and any(config.BACKUP_DIR.iterdir()):
+    if __load_manifest() or __get_legacy_files():
         LOGGER.info(f"Found backups at '{config.BACKUP_DIR}'")
         return True
     else:
@@ -6,7 +6,8 @@ from pathlib import Path
 import sys
 from typing import NoReturn
 
-from hephaistos import backups, config, hashes, helpers, interactive, lua_mod, patchers, sjson_data
+from hephaistos import backups, config, engine_offsets, hashes, helpers, interactive, lua_mod, patch_state, patchers, resolution_profiles, sjson_data
+from hephaistos.backups import BackupCompression
 from hephaistos.config import LOGGER
 from hephaistos.helpers import AspectRatio, HadesNotFound, HUD, ModImporterRuntimeError, Platform, Scaling
 
@@ -48,6 +49,8 @@ class ParserBase(ArgumentParser):
             help="path to Hades directory (default: current directory)")
         self.add_argument('--no-modimporter', action='store_false', default=True, dest='modimporter',
             help="do not use modimporter for registering / unregistering Hephaistos (default: use modimporter if available)")
+        self.add_argument('--paranoid', action='store_true',
+            help="verify hashes of all files, even if their size and modification time did not change since they were last hashed")
 
     def error(self, message) -> NoReturn:
         """Print help when user supplies invalid arguments."""
@@ -70,8 +73,12 @@ class Hephaistos(ParserBase):
         super().__init__(prog=config.HEPHAISTOS_NAME, description="Hephaistos CLI", **kwargs)
         subparsers = self.add_subparsers(parser_class=ParserBase,
             help="one of:", metavar='subcommand', dest='subcommand')
+        patch_subcommand = PatchSubcommand()
         self.subcommands: dict[str, BaseSubcommand] = {
-            'patch': PatchSubcommand(),
+            'patch': patch_subcommand,
+            'update': UpdateSubcommand(patch_subcommand),
+            'prepare': PrepareSubcommand(),
+            'switch': SwitchSubcommand(),
             'restore': RestoreSubcommand(),
             'status': StatusSubcommand(),
             'version': VersionSubcommand(),
@@ -116,6 +123,10 @@ class Hephaistos(ParserBase):
             config.modimporter = helpers.try_get_modimporter()
         else:
             LOGGER.info("Using '--no-modimporter': will not run 'modimporter', even if available")
+        # paranoid
+        if args.paranoid:
+            LOGGER.info("Using '--paranoid': will verify hashes of all files")
+            config.paranoid = True
 
     def __configure_hades_dir(self, hades_dir_arg: str) -> None:
         # when not specifying `--hades-dir` manually,
@@ -320,10 +331,20 @@ class PatchSubcommand(BaseSubcommand):
             help="do not patch custom resolution in 'ProfileX.sjson' configuration file (default: patch custom resolution)")
         self.add_argument('-f', '--force', action='store_true',
             help="force patching, bypassing hash check and removing previous backups (to be used after a game update)")
-
-    def handler(self, width: int, height: int, scaling: Scaling, hud: HUD, custom_resolution: bool, force: bool, **kwargs) -> None:
+        self.add_argument('-j', '--jobs', type=int, default=None,
+            help="number of files to patch in parallel (default: number of cores)")
+        self.add_argument('--backup-compression', type=BackupCompression, default=BackupCompression.NONE,
+            choices=[BackupCompression.NONE.value, BackupCompression.ZLIB.value, BackupCompression.LZMA.value],
+            help="compress backups into a single archive, trading CPU time when patching for disk space (default: 'none')")
+        self.add_argument('--delta-engine-backups', action='store_true',
+            help="only back up the original bytes of engine files that are patched, rather than whole engine files")
+        self.add_argument('--backup-store', type=Path, default=None,
+            help="path to a directory where backups are stored, which may be shared between several Hades directories as identical files are only stored once (default: 'hephaistos-data/backups')")
+
+    def handler(self, width: int, height: int, scaling: Scaling, hud: HUD, custom_resolution: bool, force: bool, jobs: int=None, backup_store: Path=None, backup_compression: BackupCompression=BackupCompression.NONE, delta_engine_backups: bool=False, update: bool=False, **kwargs) -> None:
         """Compute viewport depending on arguments, then patch all needed files and install Lua mod.
-        If using '--force', discard backups, hashes and SJSON data, and uninstall Lua mod."""
+        If using '--force', discard backups, hashes and SJSON data, and uninstall Lua mod.
+        If `update` is True (see `update` subcommand), only repatch files modified since they were last patched."""
         scaling, hud = helpers.autodetect(width, height, scaling, hud)
         helpers.configure_screen_variables(width, height, scaling)
         LOGGER.info(f"Using resolution: {config.resolution.width, config.resolution.height}")
@@ -337,46 +358,186 @@ class PatchSubcommand(BaseSubcommand):
             LOGGER.info("Using '--no-custom-resolution': will not bypass monitor resolution detection")
         config.custom_resolution = custom_resolution
 
-        if force:
+        if update:
+            LOGGER.info("Updating: will only repatch files modified since they were last patched and store new backups / hashes for them")
+            config.update_only = True
+            config.force = True
+        elif force:
             LOGGER.info("Using '--force': will repatch on top of existing files in case of hash mismatch and store new backups / hashes")
             config.force = True
 
+        if jobs is not None:
+            LOGGER.info(f"Using '--jobs={jobs}': will patch up to {jobs} files in parallel")
+            config.jobs = max(jobs, 1)
+
+        if backup_store is not None:
+            LOGGER.info(f"Using '--backup-store={backup_store}': will store backups at '{backup_store.resolve()}'")
+            config.backup_store = backup_store
+
+        if backup_compression != BackupCompression.NONE:
+            LOGGER.info(f"Using '--backup-compression={backup_compression}': will compress backups into '{backups.ARCHIVE_FILE}'")
+        config.backup_compression = backup_compression
+
+        if delta_engine_backups:
+            LOGGER.info("Using '--delta-engine-backups': will only back up original bytes of patched engine files")
+            config.delta_engine_backups = True
+
+        parameters = {
+            'width': width,
+            'height': height,
+            'scaling': scaling,
+            'hud': hud,
+            'custom_resolution': custom_resolution,
+            'backup_store': str(backup_store) if backup_store is not None else None,
+            'backup_compression': backup_compression,
+            'delta_engine_backups': delta_engine_backups,
+        }
+        # complete writes interrupted by a crash or power loss (if any) first,
+        # so that patched files match their stored hashes again
+        patchers.recover(lua_mod.get_directories())
+
+        # nothing to repatch if patched files (including the Lua hook) are
+        # unmodified: only reapply custom resolution, rewritten by the game
+        if not force and patch_state.check(parameters):
+            LOGGER.info("Hades is already patched with these parameters and no patched files were modified since: nothing to repatch")
+            patchers.patch_profile_sjsons()
+            return
+
         # run 'modimporter --clean' (if available) to restore everything before patching
         if config.modimporter:
             LOGGER.info(f"Running 'modimporter --clean' to restore original state before patching")
             helpers.run_modimporter(clean_only=True) 
 
         try:
+            patchers.skipped_files.clear()
+            patchers.check_hashes()
             patchers.patch_engines()
             patchers.patch_sjsons()
             patchers.patch_profile_sjsons()
             lua_mod.install()
+            patchers.report_skipped_files()
+            patch_state.store(parameters, patchers.get_patched_files() + lua_mod.get_installed_files())
         except hashes.HashMismatch as e:
             LOGGER.error(e)
             if config.interactive_mode:
                 LOGGER.error("It looks like the game was updated. Do you wish to discard previous backups and re-patch Hades from its current state?")
                 choice = interactive.pick(options=['Yes', 'No',], recommended_option='Yes', additional_option=None)
                 if choice == 'Yes':
-                    self.handler(width, height, scaling, hud, custom_resolution, force=True)
+                    self.handler(width, height, scaling, hud, custom_resolution, force=True, jobs=jobs, backup_store=backup_store, backup_compression=backup_compression, delta_engine_backups=delta_engine_backups)
             else:
-                LOGGER.error("Was the game updated? Re-run with '--force' to discard previous backups and re-patch Hades from its current state.")
+                LOGGER.error("Was the game updated? Run 'update' to only re-patch modified files, or re-run with '--force' to discard previous backups and re-patch Hades from its current state.")
         except (LookupError, FileExistsError) as e:
             LOGGER.error(e)
 
 
+class UpdateSubcommand(BaseSubcommand):
+    def __init__(self, patch_subcommand: PatchSubcommand, **kwargs) -> None:
+        super().__init__(description="re-patch Hades files modified since last patch (e.g. by a game update)", **kwargs)
+        self.patch_subcommand = patch_subcommand
+        self.add_argument('-j', '--jobs', type=int, default=None,
+            help="number of files to patch in parallel (default: number of cores)")
+
+    def handler(self, jobs: int=None, **kwargs) -> None:
+        """Patch with the same parameters as last patch, but only re-patch files
+        which were modified since, keeping backups, hashes and SJSON data of
+        other files."""
+        try:
+            parameters = patch_state.get()
+        except LookupError as e:
+            LOGGER.error(e)
+            LOGGER.error("Hades must have been patched with this version of Hephaistos to be updated: use 'patch' instead.")
+            return
+        LOGGER.info(f"Updating Hades files patched with: {', '.join(f'{key}={value}' for key, value in parameters.items())}")
+        self.patch_subcommand.handler(
+            parameters['width'],
+            parameters['height'],
+            Scaling(parameters['scaling']),
+            HUD(parameters['hud']),
+            parameters['custom_resolution'],
+            force=False,
+            jobs=jobs,
+            backup_store=Path(parameters['backup_store']) if parameters['backup_store'] is not None else None,
+            backup_compression=BackupCompression(parameters['backup_compression']),
+            delta_engine_backups=parameters['delta_engine_backups'],
+            update=True,
+        )
+
+
+class PrepareSubcommand(BaseSubcommand):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(description="prepare a named resolution profile to switch to later on", **kwargs)
+        self.add_argument('name', help="resolution profile name")
+        self.add_argument('width', type=int, help="display resolution width")
+        self.add_argument('height', type=int, help="display resolution height")
+        self.add_argument('--scaling', type=Scaling, default=Scaling.AUTODETECT,
+            choices=[Scaling.HOR_PLUS.value, Scaling.VERT_PLUS.value, Scaling.PIXEL_BASED.value],
+            help="scaling algorithm (default: 'hor+' for wider aspect ratios / 'vert+' for taller aspect ratios)")
+        self.add_argument('--hud', type=HUD, default=HUD.AUTODETECT,
+            choices=[HUD.EXPAND.value, HUD.CENTER.value],
+            help="HUD mode (default: 'expand' for most aspect ratios / 'center' for 48:9 and wider)")
+        self.add_argument('--no-custom-resolution', action='store_false', default=True, dest='custom_resolution',
+            help="do not patch custom resolution in 'ProfileX.sjson' configuration file when switching (default: patch custom resolution)")
+        self.add_argument('-j', '--jobs', type=int, default=None,
+            help="number of files to patch in parallel (default: number of cores)")
+
+    def handler(self, name: str, width: int, height: int, scaling: Scaling, hud: HUD, custom_resolution: bool, jobs: int=None, **kwargs) -> None:
+        """Patch engine and SJSON files and configure Lua mod from backups into
+        a resolution profile, leaving Hades files untouched."""
+        scaling, hud = helpers.autodetect(width, height, scaling, hud)
+        helpers.configure_screen_variables(width, height, scaling)
+        config.center_hud = True if hud == HUD.CENTER else False
+        LOGGER.info(f"Preparing resolution profile '{name}' for resolution {config.resolution.width, config.resolution.height} with '--scaling={scaling}' (viewport {config.new_screen.width, config.new_screen.height}) and '--hud={hud}'")
+        if jobs is not None:
+            config.jobs = max(jobs, 1)
+        try:
+            resolution_profiles.prepare(name, {
+                'width': width,
+                'height': height,
+                'scaling': scaling,
+                'hud': hud,
+                'custom_resolution': custom_resolution,
+            })
+        except hashes.HashMismatch as e:
+            LOGGER.error(e)
+            LOGGER.error("Was the game updated? Run 'update' first, then re-run 'prepare'.")
+        except (LookupError, ValueError) as e:
+            LOGGER.error(e)
+
+
+class SwitchSubcommand(BaseSubcommand):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(description="switch Hades to a resolution profile previously prepared", **kwargs)
+        self.add_argument('name', help="resolution profile name")
+
+    def handler(self, name: str, **kwargs) -> None:
+        """Move files of a resolution profile into place and apply its custom resolution."""
+        try:
+            resolution_profiles.switch(name)
+        except hashes.HashMismatch as e:
+            LOGGER.error(e)
+            LOGGER.error("Was the game updated? Run 'update' first, then re-run 'prepare' for each resolution profile.")
+        except (LookupError, ValueError) as e:
+            LOGGER.error(e)
+
+
 class RestoreSubcommand(BaseSubcommand):
     def __init__(self, **kwargs) -> None:
         super().__init__(description="restore Hades to its pre-Hephaistos state", **kwargs)
 
     def handler(self, **kwargs) -> None:
-        """Restore backups, discard hashes and SJSON data, uninstall Lua mod."""
+        """Restore backups, discard hashes, SJSON data and engine offsets, uninstall Lua mod."""
         # run 'modimporter --clean' (if available) to unregister Hephaistos
         if config.modimporter:
             LOGGER.info(f"Running 'modimporter --clean' to unregister Hephaistos")
             helpers.run_modimporter(clean_only=True)
+        patchers.recover(lua_mod.get_directories())
         backups.restore()
         hashes.discard()
         sjson_data.discard()
+        engine_offsets.discard()
+        patch_state.discard()
+        resolution_profiles.discard()
+        helpers.discard_ms_store_profiles()
         lua_mod.uninstall()
         # clean up Hephaistos data dir if empty (using standalone executable)
         if not any(config.HEPHAISTOS_DATA_DIR.iterdir()):
@@ -394,10 +555,12 @@ class StatusSubcommand(BaseSubcommand):
 
     def handler(self, **kwargs) -> None:
         """Check Hades and Hephaistos files and report back on probable current status."""
+        # SJSON data is only stored for SJSON files which could not be patched
+        # by splicing, hence it is only reported and not checked
+        sjson_data.status()
         hephaistos_data_checks = [
             backups.status(),
             hashes.status(),
-            sjson_data.status(),
         ]
         hades_engine_checks = [
             patchers.patch_engines_status(),
@@ -29,17 +29,28 @@ LATEST_RELEASE_API_URL = 'https://api.github.com/repos/nbusseneau/hephaistos/rel
 HEPHAISTOS_NAME = 'hephaistos'
 HEPHAISTOS_DATA_DIR = Path(HEPHAISTOS_NAME + '-data')
 BACKUP_DIR = HEPHAISTOS_DATA_DIR.joinpath('backups')
+BACKUPS_FILE = HEPHAISTOS_DATA_DIR.joinpath('backups.json')
+BACKUP_TEMP_DIR = HEPHAISTOS_DATA_DIR.joinpath('backups-temp')
+ENGINE_OFFSETS_DIR = HEPHAISTOS_DATA_DIR.joinpath('engine-offsets')
+HASHES_FILE = HEPHAISTOS_DATA_DIR.joinpath('hashes.json')
 HASH_DIR = HEPHAISTOS_DATA_DIR.joinpath('hashes')
 # If running from PyInstaller, get Lua mod source files from bundled data
 # otherwise get from regular `hephaistos-data` folder
 MOD_SOURCE_DIR = Path(getattr(sys, '_MEIPASS', '.')).joinpath(HEPHAISTOS_DATA_DIR).joinpath('lua')
 SJSON_DATA_DIR = HEPHAISTOS_DATA_DIR.joinpath('sjson-data')
+MS_STORE_PROFILES_FILE = HEPHAISTOS_DATA_DIR.joinpath('ms-store-profiles.json')
+PATCH_STATE_FILE = HEPHAISTOS_DATA_DIR.joinpath('patch-state.json')
+JOURNAL_FILE = HEPHAISTOS_DATA_DIR.joinpath('journal.json')
+RESOLUTION_PROFILES_DIR = HEPHAISTOS_DATA_DIR.joinpath('resolution-profiles')
 SJSON_SUFFIX = '.sjson'
+TEMPORARY_SUFFIX = '.hephaistos-tmp'
 
 # Hephaistos variables
 platform = None
 interactive_mode = True
 force = False
+update_only = False
+paranoid = False
 hades_dir: Path
 content_dir: Path
 resolution: Screen
@@ -50,6 +61,10 @@ scale_factor_Y: float
 scale_factor: float
 center_hud = False
 modimporter: Path = None
+jobs: int = None
+backup_store: Path = None
+backup_compression = 'none'
+delta_engine_backups = False
 
 # Setup logging
 logging.config.dictConfig({
@@ -0,0 +1,48 @@
+from distutils import dir_util
+import json
+from pathlib import Path
+
+from hephaistos import config
+from hephaistos.config import LOGGER
+
+
+def get(file: Path, digest: str) -> dict[str, list[tuple[int, int]]]:
+    """Return offsets and lengths of hex patches matches previously found in
+    engine `file`, or None if there are none or if they were found for another
+    original engine (e.g. after a game update) or another Hephaistos version."""
+    offsets_file = __get_file(file)
+    if not offsets_file.exists():
+        return None
+    try:
+        data = json.loads(offsets_file.read_bytes())
+        sha256, version, offsets = data['sha256'], data['version'], data['offsets']
+    except (ValueError, KeyError, TypeError) as e:
+        LOGGER.debug(f"Engine offsets at '{offsets_file}' are corrupted: {e}")
+        return None
+    if sha256 != digest or version != config.VERSION or not isinstance(offsets, dict):
+        LOGGER.debug(f"Engine offsets at '{offsets_file}' are outdated")
+        return None
+    return offsets
+
+
+def store(file: Path, digest: str, offsets: dict[str, list[tuple[int, int]]]) -> Path:
+    offsets_file = __get_file(file)
+    offsets_file.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        'version': config.VERSION,
+        'sha256': digest,
+        'offsets': offsets,
+    }
+    offsets_file.write_text(json.dumps(data))
+    LOGGER.debug(f"Stored engine offsets for '{file}' at '{offsets_file}'")
+    return offsets_file
+
+
+def __get_file(file: Path) -> Path:
+    return config.ENGINE_OFFSETS_DIR.joinpath(file.relative_to(config.hades_dir)).with_suffix('.json')
+
+
+def discard() -> None:
+    if config.ENGINE_OFFSETS_DIR.exists():
+        dir_util.remove_tree(str(config.ENGINE_OFFSETS_DIR))
+        LOGGER.info(f"Discarded engine offsets at '{config.ENGINE_OFFSETS_DIR}'")
@@ -1,51 +1,197 @@
 from distutils import dir_util
 import hashlib
+import os
 from pathlib import Path
 
-from hephaistos import config
+from hephaistos import config, helpers
 from hephaistos.config import LOGGER
 
 
+# Hashes are stored in a single manifest along with the size and modification
+# time of each file, so that unchanged files can be trusted without hashing
+# them again (unless using '--paranoid')
+MANIFEST_VERSION = 1
+# Hashes stored by previous Hephaistos versions in one text file per file
 HASH_FILE_EXTENSION = '.sha256'
 
 
-def check(file: Path) -> None:
-    hash_file = __get_file(file)
-    if not hash_file.exists():
+class HashMismatch(LookupError): ...
+
+
+def check(file: Path, refresh: bool=True) -> bool:
+    """Check `file` against its stored hash. If `refresh` is False, the stored
+    entry of a file that was only touched is not refreshed (e.g. when only
+    reporting status)."""
+    entry = __get_entry(file)
+    if entry is None:
         return False
-    stored_hash = hash_file.read_text()
-    current_hash = hashlib.sha256(file.read_bytes()).hexdigest()
-    if current_hash != stored_hash:
+    stat = file.stat()
+    if stat.st_size != entry.get('size', stat.st_size):
         raise HashMismatch(f"Hash file mismatch: '{file}' was modified.")
+    if not config.paranoid and (stat.st_size, stat.st_mtime_ns) == (entry.get('size'), entry.get('mtime_ns')):
+        LOGGER.debug(f"Size and modification time match for '{file}': trusting stored hash")
+        return True
+    current_hash = __hash(file, stat)
+    if current_hash != entry['sha256']:
+        raise HashMismatch(f"Hash file mismatch: '{file}' was modified.")
+    # file was only touched: refresh its entry so that it is trusted next time
+    if refresh:
+        __update_entries({__get_key(file): __get_new_entry(stat, current_hash)})
     return True
 
 
+def check_many(files: list[Path], refresh: bool=True) -> list[bool]:
+    """Check all `files` concurrently, remembering computed hashes, and raise the
+    first `HashMismatch` (in `files` order) if any."""
+    return helpers.run_concurrently(check, [(file, refresh) for file in files])
+
+
 def store(file: Path) -> Path:
-    hash_file = __get_file(file)
-    hash_file.parent.mkdir(parents=True, exist_ok=True)
-    hash_file.write_text(hashlib.sha256(file.read_bytes()).hexdigest())
-    LOGGER.debug(f"Stored hash for '{file}' at '{hash_file}'")
-    return hash_file
+    return store_many([file])
+
+
+def store_many(files: list[Path]) -> Path:
+    """Hash all `files` concurrently, and store their hashes at once."""
+    stats = [file.stat() for file in files]
+    digests = helpers.run_concurrently(__hash, zip(files, stats))
+    __update_entries({__get_key(file): __get_new_entry(stat, digest) for file, stat, digest in zip(files, stats, digests)})
+    for file in files:
+        LOGGER.debug(f"Stored hash for '{file}' in '{config.HASHES_FILE}'")
+    return config.HASHES_FILE
+
+
+def get_entry(file: Path) -> dict:
+    """Return size, modification time and SHA-256 of `file`, trusting the
+    stored hash if `file` was not modified since it was stored (unless using
+    '--paranoid')."""
+    stat = file.stat()
+    entry = __get_entry(file)
+    if entry is not None and not config.paranoid and (stat.st_size, stat.st_mtime_ns) == (entry.get('size'), entry.get('mtime_ns')):
+        return entry
+    return __get_new_entry(stat, __hash(file, stat))
+
+
+def verify(file: Path, entry: dict) -> bool:
+    """Return True if `file` still matches `entry` (as returned by
+    `get_entry`). As with `check`, files with matching size and modification
+    time are trusted without hashing them (unless using '--paranoid')."""
+    try:
+        stat = file.stat()
+    except FileNotFoundError:
+        return False
+    if stat.st_size != entry['size']:
+        return False
+    if not config.paranoid and stat.st_mtime_ns == entry['mtime_ns']:
+        return True
+    return __hash(file, stat) == entry['sha256']
+
+
+def store_entries(entries: dict[Path, dict]) -> Path:
+    """Store hashes of files already known from `entries` (as returned by
+    `get_entry`), without hashing them again."""
+    __update_entries({__get_key(file): {'size': entry['size'], 'mtime_ns': entry['mtime_ns'], 'sha256': entry['sha256']} for file, entry in entries.items()})
+    return config.HASHES_FILE
+
+
+def digest(file: Path) -> str:
+    """Return SHA-256 hex digest of `file`."""
+    return __hash(file, file.stat())
+
 
+# files are hashed in chunks rather than read in full, so that memory usage
+# does not grow with file size (engine files are tens of MiB)
+HASH_CHUNK_SIZE = 1024 * 1024
+# hashes computed during this run, by file path, along with the size and
+# modification time they were computed with
+__hashes: dict[str, tuple[int, int, str]] = {}
 
-def __get_file(file: Path) -> Path:
-    config.HASH_DIR.mkdir(parents=True, exist_ok=True)
+
+def __hash(file: Path, stat: os.stat_result) -> str:
+    size, mtime_ns, sha256 = __hashes.get(str(file), (None, None, None))
+    if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        digest = hashlib.sha256()
+        buffer = bytearray(HASH_CHUNK_SIZE)
+        view = memoryview(buffer)
+        with file.open('rb', buffering=0) as file_handle:
+            while size := file_handle.readinto(buffer):
+                digest.update(view[:size])
+        sha256 = digest.hexdigest()
+        __hashes[str(file)] = (stat.st_size, stat.st_mtime_ns, sha256)
+    return sha256
+
+
+def forget(file: Path) -> None:
+    """Forget hash computed for `file` during this run, once Hephaistos wrote
+    it: modification times may be too coarse (e.g. 2 seconds on FAT) to tell
+    apart writes of the same size in quick succession."""
+    __hashes.pop(str(file), None)
+
+
+def __get_key(file: Path) -> str:
+    return file.relative_to(config.hades_dir).as_posix()
+
+
+def __get_new_entry(stat, sha256: str) -> dict:
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+
+
+def __get_entry(file: Path) -> dict:
+    entry = __load_manifest().get(__get_key(file))
+    if entry is None:
+        hash_file = __get_legacy_file(file)
+        if hash_file.exists():
+            entry = {'sha256': hash_file.read_text()}
+    return entry
+
+
+# manifest is cached along with the size and modification time it was loaded
+# with, and only reloaded if modified (e.g. from another worker process)
+__manifest_cache: tuple[tuple[int, int], dict[str, dict]] = (None, {})
+
+
+def __load_manifest(cached: bool=True) -> dict[str, dict]:
+    global __manifest_cache
+    try:
+        stat = config.HASHES_FILE.stat()
+    except FileNotFoundError:
+        return {}
+    stat_key = (stat.st_size, stat.st_mtime_ns)
+    cached_stat_key, files = __manifest_cache
+    if not cached or stat_key != cached_stat_key:
+        files = helpers.load_manifest(config.HASHES_FILE, MANIFEST_VERSION)
+        __manifest_cache = (stat_key, files)
+    return files
+
+
+def __update_entries(entries: dict[str, dict]) -> None:
+    global __manifest_cache
+    helpers.update_manifest(config.HASHES_FILE, MANIFEST_VERSION, entries)
+    # manifest may have been updated by other worker processes since it was
+    # cached: reload it on next lookup
+    __manifest_cache = (None, {})
+
+
+def __get_legacy_file(file: Path) -> Path:
     return config.HASH_DIR.joinpath(file.relative_to(config.hades_dir)).with_suffix(HASH_FILE_EXTENSION)
 
 
 def discard() -> None:
+    discarded = False
+    for file in [config.HASHES_FILE, config.HASHES_FILE.with_suffix('.lock')]:
+        if file.exists():
+            file.unlink()
+            discarded = True
     if config.HASH_DIR.exists():
         dir_util.remove_tree(str(config.HASH_DIR))
-        LOGGER.info(f"Discarded hashes at '{config.HASH_DIR}'")
+        discarded = True
+    if discarded:
+        LOGGER.info(f"Discarded hashes at '{config.HASHES_FILE}'")
 
 
 def status() -> None:
-    if config.HASH_DIR.exists() and any(config.HASH_DIR.iterdir()):
-        LOGGER.info(f"Found hashes at '{config.HASH_DIR}'")
+    if config.HASHES_FILE.exists() or (config.HASH_DIR.exists() and any(config.HASH_DIR.iterdir())):
+        LOGGER.info(f"Found hashes at '{config.HASHES_FILE}'")
         return True
     else:
-        LOGGER.info(f"No hashes found at '{config.HASH_DIR}'")
+        LOGGER.info(f"No hashes found at '{config.HASHES_FILE}'")
         return False
-
-
-class HashMismatch(LookupError): ...
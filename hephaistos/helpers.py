@@ -1,3 +1,4 @@
+import concurrent.futures
 import contextlib
 from enum import Enum
 import importlib.util
@@ -8,16 +9,16 @@ import os.path
 from pathlib import Path
 import platform
 import re
+import shutil
 import subprocess
 import sys
+import threading
 from types import ModuleType
-from typing import Union
+from typing import Any, Callable, Iterable, Union
 import urllib.error
 import urllib.request
 
-import sjson
-
-from hephaistos import config
+from hephaistos import config, sjson_parser
 from hephaistos.config import LOGGER
 
 
@@ -250,20 +251,116 @@ def try_get_profile_sjson_files() -> list[Path]:
     return []
 
 
+# Microsoft Store profiles are small SJSON text files, as opposed to binary
+# save files (which may be several MiB), so that most files can be ruled out
+# without being read in full
+PROFILE_MAX_SIZE = 1024 * 1024
+PROFILE_SNIFF_SIZE = 4096
+PROFILE_SNIFF_REGEX = re.compile(rb'\s*(?:[{"/A-Za-z_]|$)')
+
+
 def __find_sjsons(save_dir: Path) -> list[Path]:
     """Find actual SJSON files in directory."""
-    LOGGER.debug(f"Detecting SJSON files from '{save_dir}'")
-    sjsons: list[Path] = []
+    try:
+        return __load_ms_store_profiles(save_dir)
+    except LookupError as e:
+        LOGGER.debug(f"{e}: detecting SJSON files from '{save_dir}'")
+    directories = {save_dir: save_dir.stat().st_mtime_ns}
+    candidates = []
     for file in save_dir.rglob('*'):
         try:
-            sjson.loads(Path(file).read_text())
-            LOGGER.debug(f"Found valid SJSON in '{file}'")
-            sjsons.append(file)
-        except:
-            pass
+            stat = file.stat()
+            if file.is_dir():
+                directories[file] = stat.st_mtime_ns
+            # skip files left behind by an interrupted patch
+            elif file.name.endswith(config.TEMPORARY_SUFFIX):
+                continue
+            elif stat.st_size <= PROFILE_MAX_SIZE and __sniff_sjson(file):
+                candidates.append(file)
+        except OSError as e:
+            LOGGER.debug(f"Could not read '{file}': {e}")
+    results = run_concurrently(__is_sjson, [(file,) for file in candidates])
+    sjsons = [file for file, is_sjson in zip(candidates, results) if is_sjson]
+    __store_ms_store_profiles(save_dir, directories, sjsons)
     return sjsons
 
 
+def __sniff_sjson(file: Path) -> bool:
+    with file.open('rb') as file_handle:
+        head = file_handle.read(PROFILE_SNIFF_SIZE)
+    return b'\0' not in head and PROFILE_SNIFF_REGEX.match(head) is not None
+
+
+def __is_sjson(file: Path) -> bool:
+    try:
+        sjson_parser.validate(file.read_text())
+    except (OSError, UnicodeDecodeError, sjson_parser.SJSONSyntaxError) as e:
+        LOGGER.debug(f"Not a valid SJSON file '{file}': {e}")
+        return False
+    LOGGER.debug(f"Found valid SJSON in '{file}'")
+    return True
+
+
+def __load_ms_store_profiles(save_dir: Path) -> list[Path]:
+    """Load profiles previously found in `save_dir`, provided no file was added
+    or removed since then, i.e. no directory was modified."""
+    if not config.MS_STORE_PROFILES_FILE.exists():
+        raise LookupError(f"Microsoft Store profiles file '{config.MS_STORE_PROFILES_FILE}' is missing")
+    try:
+        data = json.loads(config.MS_STORE_PROFILES_FILE.read_text())
+        directories = data['directories']
+        profiles = [Path(profile) for profile in data['profiles']]
+    except (ValueError, KeyError, TypeError) as e:
+        raise LookupError(f"Microsoft Store profiles file '{config.MS_STORE_PROFILES_FILE}' is corrupted") from e
+    if data.get('save_dir') != str(save_dir):
+        raise LookupError(f"Microsoft Store profiles file '{config.MS_STORE_PROFILES_FILE}' was stored for another save directory")
+    for directory, mtime_ns in directories.items():
+        try:
+            if os.stat(directory).st_mtime_ns != mtime_ns:
+                raise LookupError(f"Save directory '{directory}' was modified")
+        except OSError as e:
+            raise LookupError(f"Save directory '{directory}' is missing") from e
+    LOGGER.debug(f"Loaded Microsoft Store profiles from '{config.MS_STORE_PROFILES_FILE}'")
+    return profiles
+
+
+def __store_ms_store_profiles(save_dir: Path, directories: dict[Path, int], profiles: list[Path]) -> None:
+    data = {
+        'save_dir': str(save_dir),
+        'directories': {str(directory): mtime_ns for directory, mtime_ns in directories.items()},
+        'profiles': [str(profile) for profile in profiles],
+    }
+    config.MS_STORE_PROFILES_FILE.parent.mkdir(parents=True, exist_ok=True)
+    config.MS_STORE_PROFILES_FILE.write_text(json.dumps(data))
+    LOGGER.debug(f"Saved Microsoft Store profiles to '{config.MS_STORE_PROFILES_FILE}'")
+
+
+def refresh_ms_store_profiles(directories: dict[Path, int]) -> None:
+    """Record modification times of `directories` (mapped to their previous
+    ones) in stored Microsoft Store profiles after replacing files in them."""
+    if not config.MS_STORE_PROFILES_FILE.exists():
+        return
+    try:
+        data = json.loads(config.MS_STORE_PROFILES_FILE.read_text())
+        stored_directories = data['directories']
+    except (ValueError, KeyError, TypeError):
+        return
+    refreshed = False
+    for directory, mtime_ns in directories.items():
+        if stored_directories.get(str(directory)) == mtime_ns:
+            stored_directories[str(directory)] = directory.stat().st_mtime_ns
+            refreshed = True
+    if refreshed:
+        config.MS_STORE_PROFILES_FILE.write_text(json.dumps(data))
+        LOGGER.debug(f"Refreshed Microsoft Store profiles in '{config.MS_STORE_PROFILES_FILE}'")
+
+
+def discard_ms_store_profiles() -> None:
+    if config.MS_STORE_PROFILES_FILE.exists():
+        config.MS_STORE_PROFILES_FILE.unlink()
+        LOGGER.info(f"Discarded Microsoft Store profiles at '{config.MS_STORE_PROFILES_FILE}'")
+
+
 VERSION_CHECK_ERROR = "could not check latest version -- perhaps no Internet connection is available?"
 
 
@@ -302,6 +399,163 @@ def try_get_modimporter() -> Path:
     return None
 
 
+def run_concurrently(function: Callable, items: Iterable[tuple], processes: bool=False, return_exceptions: bool=False) -> list[Any]:
+    """Call `function` with each item of `items` on `config.jobs` threads (or
+    processes), and return results in order. The first failure (in order) is
+    raised once all items are processed, unless `return_exceptions` is True."""
+    items = list(items)
+    if not items:
+        return []
+    max_workers = min(len(items), config.jobs or os.cpu_count() or 1)
+    if max_workers == 1:
+        futures = []
+        for item in items:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(function(*item))
+            except Exception as e:
+                future.set_exception(e)
+            futures.append(future)
+    elif processes:
+        initargs = (__get_config_variables(), LOGGER.getEffectiveLevel())
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=__init_worker_process, initargs=initargs) as executor:
+            futures = [executor.submit(function, *item) for item in items]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(function, *item) for item in items]
+    if return_exceptions:
+        return [future.exception() or future.result() for future in futures]
+    return [future.result() for future in futures]
+
+
+@contextlib.contextmanager
+def file_lock(file: Path):
+    """Context manager holding an exclusive lock on `file` (created if missing),
+    for serializing updates to files shared between worker processes."""
+    file.parent.mkdir(parents=True, exist_ok=True)
+    with file.open('a+b') as file_handle:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    # `LK_LOCK` only retries for 10 seconds before giving up
+                    msvcrt.locking(file_handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                file_handle.seek(0)
+                msvcrt.locking(file_handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file_handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file_handle, fcntl.LOCK_UN)
+
+
+def write_atomically(file: Path, data: bytes, sync: bool=False) -> None:
+    """Write `data` to a temporary file moved over `file`, so that it is never
+    partially written, and flush it to disk if `sync` is True."""
+    file.parent.mkdir(parents=True, exist_ok=True)
+    temporary_file = file.with_name(f'{file.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+    try:
+        temporary_file.write_bytes(data)
+        if sync:
+            sync_to_disk([temporary_file])
+        os.replace(temporary_file, file)
+    except BaseException:
+        temporary_file.unlink(missing_ok=True)
+        raise
+    if sync:
+        sync_to_disk([file.parent])
+
+
+def sync_to_disk(paths: Iterable[Path]) -> None:
+    """Flush `paths` (files, or directories after files were moved into them)
+    to disk, concurrently so that the filesystem may batch them together."""
+    run_concurrently(__sync_to_disk, [(path,) for path in set(paths)])
+
+
+def __sync_to_disk(path: Path) -> None:
+    if path.is_dir():
+        # directories cannot be opened (nor flushed) on Windows, where moves
+        # are flushed along with the moved files
+        if os.name == 'nt':
+            return
+        fd = os.open(path, os.O_RDONLY)
+    else:
+        # files must be opened with write access to be flushed on Windows
+        fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def load_manifest(file: Path, version: int) -> dict[str, dict]:
+    """Load entries from JSON manifest `file`, or no entries if it is missing,
+    corrupted, or was stored in another `version`."""
+    try:
+        manifest = json.loads(file.read_bytes())
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        LOGGER.debug(f"Manifest '{file}' is corrupted: ignoring its entries")
+        return {}
+    if not isinstance(manifest, dict) or manifest.get('version') != version or not isinstance(manifest.get('files'), dict):
+        LOGGER.debug(f"Manifest '{file}' was stored in another format: ignoring its entries")
+        return {}
+    return manifest['files']
+
+
+def update_manifest(file: Path, version: int, entries: dict[str, dict], removed: Iterable[str]=()) -> dict[str, dict]:
+    """Add `entries` to JSON manifest `file` and remove `removed` entries under
+    a lock shared with worker processes, and return all resulting entries."""
+    with file_lock(file.with_suffix('.lock')):
+        files = {**load_manifest(file, version), **entries}
+        for key in removed:
+            files.pop(key, None)
+        write_atomically(file, json.dumps({'version': version, 'files': files}, indent=2).encode())
+    return files
+
+
+def copy_file(source: Path, destination: Path) -> None:
+    """Copy `source` to `destination`, as a reflink (i.e. a copy-on-write clone
+    sharing data with `source` until either is modified) if supported by the
+    filesystem, or else as a regular copy."""
+    if sys.platform == 'linux':
+        import fcntl
+        try:
+            with source.open('rb') as source_handle, destination.open('wb') as destination_handle:
+                fcntl.ioctl(destination_handle.fileno(), FICLONE, source_handle.fileno())
+            return
+        except OSError as e:
+            LOGGER.debug(f"Could not reflink '{source}' to '{destination}', copying instead: {e}")
+    shutil.copyfile(source, destination)
+
+
+# Linux `ioctl` request for cloning a file (from `linux/fs.h`)
+FICLONE = 0x40049409
+
+
+def __get_config_variables() -> dict[str, Any]:
+    # Hephaistos variables are the non-constant, non-callable members of `config`
+    return {
+        key: value for key, value in vars(config).items()
+        if not key.startswith('_') and not key.isupper() and not callable(value) and not isinstance(value, ModuleType)
+    }
+
+
+def __init_worker_process(config_variables: dict[str, Any], log_level: int) -> None:
+    for key, value in config_variables.items():
+        setattr(config, key, value)
+    LOGGER.setLevel(log_level)
+
+
 @contextlib.contextmanager
 def remember_cwd():
     """Store current working directory on context enter and restore on exit."""
@@ -0,0 +1,32 @@
+import json
+from pathlib import Path
+
+from hephaistos import config, helpers
+from hephaistos.config import LOGGER
+
+
+# The journal lists files about to be replaced by their patched version, along
+# with the SHA-256 of their patched version, so that writes interrupted by a
+# crash or power loss can be completed on next run (see `patchers.recover`).
+MANIFEST_VERSION = 1
+
+
+def get() -> dict[str, dict]:
+    """Return entries of writes which were not completed, if any."""
+    # journal is written atomically: if it cannot be read, it was never
+    # completely written, i.e. none of its writes were started
+    return helpers.load_manifest(config.JOURNAL_FILE, MANIFEST_VERSION)
+
+
+def store(entries: dict[str, dict]) -> Path:
+    """Durably store `entries` before starting the writes they describe."""
+    data = json.dumps({'version': MANIFEST_VERSION, 'files': entries}, indent=2).encode()
+    helpers.write_atomically(config.JOURNAL_FILE, data, sync=True)
+    LOGGER.debug(f"Stored journal of {len(entries)} writes at '{config.JOURNAL_FILE}'")
+    return config.JOURNAL_FILE
+
+
+def discard() -> None:
+    if config.JOURNAL_FILE.exists():
+        config.JOURNAL_FILE.unlink()
+        LOGGER.debug(f"Discarded journal at '{config.JOURNAL_FILE}'")
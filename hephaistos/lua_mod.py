@@ -20,9 +20,12 @@ IMPORT_REGEX = re.compile(r'Import "../Mods/Hephaistos/(.*)"')
 def install() -> None:
     LOGGER.debug(f"Installing Lua mod from '{config.MOD_SOURCE_DIR}'")
     (mod_dir, lua_scripts_dir, relative_path_to_mod, import_statement) = __prepare_variables()
-    dir_util.copy_tree(str(config.MOD_SOURCE_DIR), str(mod_dir))
-    LOGGER.debug(f"Copied '{config.MOD_SOURCE_DIR}' to '{mod_dir}'")
-    __configure(mod_dir, relative_path_to_mod)
+    with patchers.transaction():
+        for source_file in sorted(config.MOD_SOURCE_DIR.glob('**/*')):
+            if source_file.is_file():
+                file = mod_dir.joinpath(source_file.relative_to(config.MOD_SOURCE_DIR))
+                file.parent.mkdir(parents=True, exist_ok=True)
+                __install_file(source_file, file, relative_path_to_mod)
     LOGGER.info(f"Installed Lua mod to '{mod_dir}'")
     # run modimporter (if available) to register Hephaistos
     if config.modimporter:
@@ -48,23 +51,59 @@ def __prepare_variables() -> tuple[Path, Path, str]:
     return (mod_dir, lua_scripts_dir, relative_path_to_mod, import_statement)
 
 
-def __configure(mod_dir: Path, relative_path_to_mod: str) -> None:
+def prepare(target_dir: Path) -> Path:
+    """Configure Lua mod configuration file into `target_dir` (mirroring its
+    path relative to Hades directory), leaving installed Lua mod untouched."""
+    (mod_dir, _, relative_path_to_mod, _) = __prepare_variables()
+    mod_config_file = target_dir.joinpath(mod_dir.relative_to(config.hades_dir), MOD_CONFIG_FILE)
+    mod_config_file.parent.mkdir(parents=True, exist_ok=True)
+    __install_file(config.MOD_SOURCE_DIR.joinpath(MOD_CONFIG_FILE), mod_config_file, relative_path_to_mod)
+    return mod_config_file
+
+
+def __install_file(source_file: Path, file: Path, relative_path_to_mod: str) -> None:
+    # Lua files are configured on the fly, and all files are only written if
+    # different from what is already installed
+    if source_file.suffix == '.lua':
+        source_text = source_file.read_text()
+        patched_text = __configure(file, source_text, relative_path_to_mod)
+        if patched_text != source_text:
+            patchers.write_file(file, patched_text)
+            return
+    patchers.write_file(file, source_file.read_bytes())
+
+
+def __configure(file: Path, source_text: str, relative_path_to_mod: str) -> str:
     # configure viewport
-    mod_config_file = mod_dir.joinpath(MOD_CONFIG_FILE)
-    source_text = mod_config_file.read_text()
+    patched_text = source_text
+    if file.name == MOD_CONFIG_FILE:
+        patched_text = __configure_viewport(patched_text)
+        LOGGER.debug(f"Configured '{file}'")
+
+    # configure internal mod imports
+    (patched_text, count) = IMPORT_REGEX.subn(f'Import "{relative_path_to_mod}\g<1>"', patched_text)
+    if count:
+        LOGGER.debug(f"Configured '{file}' internal mod imports ({count} occurrences)")
+    return patched_text
+
+
+def __configure_viewport(source_text: str) -> str:
     patched_text = WIDTH_REGEX.sub('\g<1>' + str(config.new_screen.width), source_text)
     patched_text = HEIGHT_REGEX.sub('\g<1>' + str(config.new_screen.height), patched_text)
-    patched_text = CENTER_HUD_REGEX.sub('\g<1>' + str(config.center_hud).lower(), patched_text)
-    mod_config_file.write_text(patched_text)
-    LOGGER.debug(f"Configured '{mod_config_file}'")
+    return CENTER_HUD_REGEX.sub('\g<1>' + str(config.center_hud).lower(), patched_text)
 
-    # configure internal mod imports
-    for file in mod_dir.glob('**/*.lua'):
-        source_text = file.read_text()
-        (patched_text, count) = IMPORT_REGEX.subn(f'Import "{relative_path_to_mod}\g<1>"', source_text)
-        if count:
-            file.write_text(patched_text)
-            LOGGER.debug(f"Configured '{file}' internal mod imports ({count} occurrences)")
+
+def get_installed_files() -> list[Path]:
+    """Return all files installed or patched when installing Lua mod, i.e. mod
+    files and Lua hook file (patched manually or registered by modimporter)."""
+    (mod_dir, lua_scripts_dir, _, _) = __prepare_variables()
+    return sorted(file for file in mod_dir.glob('**/*') if file.is_file() and not file.name.endswith(config.TEMPORARY_SUFFIX)) + [lua_scripts_dir.joinpath(patchers.HOOK_FILE)]
+
+
+def get_directories() -> list[Path]:
+    """Return directories Lua mod files are installed or patched in."""
+    mod_dir = config.content_dir.joinpath(MOD_TARGET_DIR)
+    return [mod_dir, *(directory for directory in mod_dir.glob('**/*') if directory.is_dir()), config.content_dir.joinpath(LUA_SCRIPTS_DIR)]
 
 
 def uninstall() -> None:
@@ -0,0 +1,101 @@
+import json
+from pathlib import Path
+
+from hephaistos import config, hashes, helpers
+from hephaistos.config import LOGGER
+
+
+def get() -> dict:
+    """Return parameters Hades was last patched with."""
+    return __load()['parameters']
+
+
+def get_resolution_profile() -> str:
+    """Return name of the resolution profile Hades was last switched to, or
+    None if it was patched directly."""
+    try:
+        return __load().get('resolution_profile')
+    except LookupError:
+        return None
+
+
+def store(parameters: dict, files: list[Path], resolution_profile: str=None) -> Path:
+    """Store `parameters` Hades was patched with, the hashes of patched `files`
+    (see `check`) and the name of the resolution profile switched to, if any."""
+    helpers.write_atomically(config.PATCH_STATE_FILE, serialize(parameters, files, resolution_profile))
+    LOGGER.debug(f"Stored patch state at '{config.PATCH_STATE_FILE}'")
+    return config.PATCH_STATE_FILE
+
+
+def serialize(parameters: dict, files: list[Path], resolution_profile: str=None, entries: dict[Path, dict]=None) -> bytes:
+    """Return patch state as stored by `store`, e.g. to write it along with
+    patched files. Files already known from `entries` (as returned by
+    `hashes.get_entry`) are not hashed again."""
+    entries = entries or {}
+    data = {
+        'version': config.VERSION,
+        'parameters': parameters,
+        'files': {__get_key(file): __get_entry(file, entries) for file in files},
+        'resolution_profile': resolution_profile,
+    }
+    return json.dumps(data, indent=2).encode()
+
+
+def __get_entry(file: Path, entries: dict[Path, dict]) -> dict:
+    if file not in entries:
+        return hashes.get_entry(file)
+    return {key: entries[file][key] for key in ['size', 'mtime_ns', 'sha256']}
+
+
+def check(parameters: dict) -> bool:
+    """Return True if Hades was last patched by this version of Hephaistos with
+    the same `parameters`, and none of the patched files were modified since."""
+    try:
+        data = __load()
+    except LookupError as e:
+        LOGGER.debug(e)
+        return False
+    if data.get('version') != config.VERSION:
+        LOGGER.debug(f"Hades was last patched with Hephaistos {data.get('version')}: patching again with {config.VERSION}")
+        return False
+    if data['parameters'] != parameters:
+        LOGGER.debug(f"Hades was last patched with different parameters: {data['parameters']}")
+        return False
+    files = data.get('files')
+    if not files:
+        return False
+    touched = {}
+    for key, entry in files.items():
+        file = config.hades_dir.joinpath(key)
+        if not hashes.verify(file, entry):
+            LOGGER.debug(f"'{file}' was modified since last patch")
+            return False
+        if file.stat().st_mtime_ns != entry['mtime_ns']:
+            touched[key] = hashes.get_entry(file)
+    # files were only touched: refresh their entries so that they are trusted
+    # next time
+    if touched:
+        data['files'].update(touched)
+        helpers.write_atomically(config.PATCH_STATE_FILE, json.dumps(data, indent=2).encode())
+    return True
+
+
+def discard() -> None:
+    if config.PATCH_STATE_FILE.exists():
+        config.PATCH_STATE_FILE.unlink()
+        LOGGER.info(f"Discarded patch state at '{config.PATCH_STATE_FILE}'")
+
+
+def __load() -> dict:
+    if not config.PATCH_STATE_FILE.exists():
+        raise LookupError(f"Patch state file '{config.PATCH_STATE_FILE}' is missing: was Hades patched with Hephaistos?")
+    try:
+        data = json.loads(config.PATCH_STATE_FILE.read_bytes())
+        data['parameters']
+    except (ValueError, KeyError, TypeError) as e:
+        raise LookupError(f"Patch state file '{config.PATCH_STATE_FILE}' is corrupted") from e
+    return data
+
+
+def __get_key(file: Path) -> str:
+    return file.relative_to(config.hades_dir).as_posix()
@@ -2,14 +2,18 @@ import contextlib
 import copy
 from enum import Enum
 from functools import partial, singledispatch
+import io
+import mmap
+import os
 from pathlib import Path
 import re
+import shutil
 import struct
-from typing import Any, Callable, Generator, Tuple, TypedDict, Union
+from typing import Any, Callable, Generator, Iterable, TextIO, Tuple, TypedDict, Union
 
 import sjson
 
-from hephaistos import backups, config, hashes, helpers
+from hephaistos import backups, config, engine_offsets, hashes, helpers, journal, sjson_data, sjson_parser
 from hephaistos.config import LOGGER
 from hephaistos.helpers import IntOrFloat, Platform
 
@@ -18,41 +22,347 @@ SJSON = Union[dict, list, str, IntOrFloat, Any]
 
 
 @contextlib.contextmanager
-def safe_patch_file(file: Path, store_backup: bool=True) -> Generator[Tuple[Union[SJSON, Path], Path], None, None]:
+def safe_patch_file(file: Path, store_backup: bool=True, store_hash: bool=True, delta_backup: bool=False) -> Generator[Tuple[Union[SJSON, Path], Path], None, None]:
     """Context manager for patching files in a safe manner, wrapped by backup
     and hash handling.
 
     On first run:
     - Store a backup copy of the original file for restoration with the `restore` subcommand.
-    - (If patching SJSON) Store a copy of the parsed SJSON data for speeding up subsequent patches.
-    - Store patched hash in a text file.
+    - Store patched hash in the hash manifest.
 
     On subsequent runs, check current hash against previously stored hash:
-    - If matching, repatch from the backup copy or stored SJSON data (if patching SJSON).
+    - If matching, repatch from the backup copy.
     - It not matching, the file has changed since the last patch.
+
+    Within a transaction, storing the patched hash (unless `store_hash` is
+    False) and delta backup (see `backups.update`) is deferred to its commit.
     """
     try:
         if hashes.check(file):
             LOGGER.debug(f"Hash match for '{file}': repatching based on backup file")
-            original_file, source_sjson = backups.get(file)
+            original_file = backups.get(file)
         elif store_backup:
             LOGGER.debug(f"No hash stored for '{file}': storing backup file")
-            original_file, source_sjson = backups.store(file)
+            original_file = backups.store(file, delta=delta_backup)
         else:
             LOGGER.debug(f"No hash stored for '{file}'")
-            original_file, source_sjson = None, None
+            original_file = None
     except hashes.HashMismatch as e:
         if config.force: # if using '--force', discard existing backup / hash and use new file as basis
             LOGGER.debug(f"Hash mismatch for '{file}' but running with '--force': patching based on new file")
-            original_file, source_sjson = backups.store(file)
+            original_file = backups.store(file, delta=delta_backup)
         else: # otherwise let caller decide what to do
             raise e
-    if file.suffix == config.SJSON_SUFFIX:
-        yield (source_sjson, file)
-    else:
+    # an existing delta backup only holds the original bytes changed by the
+    # previous patch, so it must be updated no matter the current options
+    delta_backup = original_file is not None and (delta_backup or backups.is_delta(file))
+    deferred = False
+    try:
         yield (original_file, file)
-    if store_backup:
-        hashes.store(file)
+        if delta_backup:
+            if file in __pending:
+                __pending_deltas[file] = original_file
+                deferred = True
+            else:
+                backups.update(file, original_file)
+    finally:
+        if original_file is not None and not deferred:
+            backups.release(original_file)
+    if store_backup and store_hash:
+        if file in __pending:
+            __pending[file] = True
+        else:
+            hashes.store(file)
+
+
+# files left untouched when patching, as their patched output was identical to
+# their current content (see `write_file`)
+skipped_files: set[Path] = set()
+
+
+def write_file(file: Path, content: Union[bytes, str, Callable[[TextIO], None]], newline: str=None) -> bool:
+    """Write `content` (bytes, text, or a function writing text to a handle) to
+    `file` in the current transaction and return True, or False if identical."""
+    temporary_file = __get_temporary_file(file)
+    __track_directory(file)
+    current = file.open('rb') if file.exists() else None
+    writer = __ComparingWriter(current, temporary_file)
+    try:
+        if isinstance(content, bytes):
+            stream = io.BufferedWriter(writer)
+            stream.write(content)
+        else:
+            stream = io.TextIOWrapper(io.BufferedWriter(writer), newline=newline)
+            content(stream) if callable(content) else stream.write(content)
+        stream.flush()
+        # current content may also be longer than written content
+        if writer.identical and current.read(1):
+            writer.diverge()
+        stream.close()
+    except BaseException:
+        writer.close()
+        temporary_file.unlink(missing_ok=True)
+        raise
+    finally:
+        if current is not None:
+            current.close()
+    if writer.identical:
+        LOGGER.debug(f"'{file}' is already identical to its patched output: left untouched")
+        skipped_files.add(file)
+        return False
+    hashes.forget(temporary_file)
+    __pending.setdefault(file, False)
+    return True
+
+
+class __ComparingWriter(io.RawIOBase):
+    """Raw binary stream comparing written data with `current` content (if
+    any), and only writing to `temporary_file` from the first difference
+    onwards, along with the identical content written until then."""
+    def __init__(self, current: io.BufferedReader, temporary_file: Path) -> None:
+        self.current = current
+        self.temporary_file = temporary_file
+        self.temporary = None
+        self.position = 0
+        if current is None:
+            self.diverge()
+
+    @property
+    def identical(self) -> bool:
+        return self.temporary is None
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        if self.identical:
+            current = self.current.read(len(data))
+            if current == data:
+                self.position += len(data)
+                return len(data)
+            self.diverge()
+        self.temporary.write(data)
+        return len(data)
+
+    def diverge(self) -> None:
+        self.temporary = self.temporary_file.open('wb')
+        if self.position:
+            self.current.seek(0)
+            self.temporary.write(self.current.read(self.position))
+
+    def close(self) -> None:
+        if self.temporary is not None:
+            self.temporary.close()
+        super().close()
+
+
+def report_skipped_files() -> None:
+    if skipped_files:
+        LOGGER.info(f"Left {len(skipped_files)} files untouched as they were already identical to their patched output")
+        skipped_files.clear()
+
+
+# patched files are written next to them and only moved into place, after
+# being journaled, once the transaction is committed (see `recover`)
+# files written in the current transaction, and whether to store their hash
+__pending: dict[Path, bool] = {}
+# originals of files whose delta backup must be updated once moved into place
+__pending_deltas: dict[Path, Path] = {}
+# entries of staged files already known, so that they are not hashed again
+__known_entries: dict[Path, dict] = {}
+# modification times of directories of written files, from before writing
+# temporary files in them
+__directories: dict[Path, int] = {}
+__transaction_depth = 0
+
+
+@contextlib.contextmanager
+def transaction() -> Generator[None, None, None]:
+    """Context manager committing all files written within at once when
+    exiting, or discarding them on error. Transactions may be nested, in which
+    case files are only committed when exiting the outermost transaction."""
+    global __transaction_depth
+    __transaction_depth += 1
+    try:
+        yield
+    except BaseException:
+        if __transaction_depth == 1:
+            __rollback()
+        raise
+    finally:
+        __transaction_depth -= 1
+    if __transaction_depth == 0:
+        __commit()
+
+
+def stage_file(source: Path, file: Path, entry: dict=None, store_hash: bool=False, original_file: Path=None) -> None:
+    """Replace `file` with a copy of `source` in the current transaction, with
+    known `entry` (see `hashes.get_entry`) and delta backup `original_file`."""
+    temporary_file = __get_temporary_file(file)
+    __track_directory(file)
+    temporary_file.unlink(missing_ok=True)
+    try:
+        os.link(source, temporary_file)
+    except OSError as e:
+        LOGGER.debug(f"Could not link '{source}' to '{temporary_file}', copying instead: {e}")
+        helpers.copy_file(source, temporary_file)
+    hashes.forget(temporary_file)
+    __pending[file] = store_hash
+    if entry is not None:
+        __known_entries[file] = entry
+    if original_file is not None:
+        __pending_deltas[file] = original_file
+
+
+def __track_directory(file: Path) -> None:
+    if file.parent not in __directories:
+        with contextlib.suppress(OSError):
+            __directories.setdefault(file.parent, file.parent.stat().st_mtime_ns)
+
+
+def __commit() -> None:
+    pending = dict(__pending)
+    deltas = dict(__pending_deltas)
+    known_entries = dict(__known_entries)
+    tracked_directories = dict(__directories)
+    __pending.clear()
+    __pending_deltas.clear()
+    __known_entries.clear()
+    __directories.clear()
+    if not pending:
+        return
+    try:
+        temporary_files = {file: __get_temporary_file(file) for file in pending}
+        # flush all patched files to disk at once, before recording them in
+        # the journal, so that the journal never refers to partial files
+        helpers.sync_to_disk(temporary_files.values())
+        entries = {}
+        for file, temporary_file in temporary_files.items():
+            stat = temporary_file.stat()
+            entries[file] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': None}
+            known_entry = known_entries.get(file)
+            if known_entry is not None and not config.paranoid and (known_entry['size'], known_entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                entries[file]['sha256'] = known_entry['sha256']
+        unknown_files = [file for file, entry in entries.items() if entry['sha256'] is None]
+        digests = helpers.run_concurrently(hashes.digest, [(temporary_files[file],) for file in unknown_files])
+        for file, digest in zip(unknown_files, digests):
+            entries[file]['sha256'] = digest
+        journal.store({str(file.absolute()): {'sha256': entry['sha256'], 'store_hash': pending[file]} for file, entry in entries.items()})
+        # files written from worker processes are not tracked, but are not
+        # written to save directories either
+        directories = {file.parent: tracked_directories.get(file.parent) or file.parent.stat().st_mtime_ns for file in pending}
+        for file, temporary_file in temporary_files.items():
+            if file in deltas:
+                backups.update(file, deltas[file], temporary_file)
+            os.replace(temporary_file, file)
+            hashes.forget(file)
+        # moved files keep the size and modification time of their temporary
+        # file, and thus do not need to be hashed again
+        hashes.store_entries({file: entry for file, entry in entries.items() if pending[file]})
+        helpers.sync_to_disk(list(directories) + [file for file in [config.HASHES_FILE, config.BACKUPS_FILE] if file.exists()] + [config.HEPHAISTOS_DATA_DIR])
+        journal.discard()
+        LOGGER.debug(f"Committed {len(pending)} patched files")
+        # moving files modifies their directories, which would otherwise
+        # invalidate Microsoft Store profiles detection
+        helpers.refresh_ms_store_profiles(directories)
+    finally:
+        for original_file in deltas.values():
+            backups.release(original_file)
+
+
+def __rollback() -> None:
+    for file in __pending:
+        __get_temporary_file(file).unlink(missing_ok=True)
+    for original_file in __pending_deltas.values():
+        backups.release(original_file)
+    LOGGER.debug(f"Discarded {len(__pending)} patched files")
+    __pending.clear()
+    __pending_deltas.clear()
+    __known_entries.clear()
+    __directories.clear()
+
+
+def recover(directories: Iterable[Path]=()) -> None:
+    """Complete moving journaled files into place if a previous run was
+    interrupted, and discard temporary files left behind otherwise."""
+    entries = journal.get()
+    if entries:
+        LOGGER.warning(f"Previous run was interrupted while patching files: completing {len(entries)} interrupted writes")
+        hashed_files = []
+        for key, entry in entries.items():
+            file = __get_journaled_file(key)
+            temporary_file = __get_temporary_file(file)
+            if temporary_file.exists():
+                if hashes.digest(temporary_file) != entry['sha256']:
+                    LOGGER.debug(f"Temporary file '{temporary_file}' does not match journal: discarding")
+                    temporary_file.unlink()
+                    continue
+                # delta backup may not have been updated yet, in which case
+                # the original file can still be rebuilt before moving
+                original_file = None
+                if backups.is_delta(file):
+                    with contextlib.suppress(LookupError):
+                        original_file = backups.get(file)
+                os.replace(temporary_file, file)
+                hashes.forget(file)
+                if original_file is not None:
+                    backups.update(file, original_file)
+                    backups.release(original_file)
+                LOGGER.info(f"Completed patching '{file}'")
+            if entry['store_hash'] and file.exists() and hashes.digest(file) == entry['sha256']:
+                hashed_files.append(file)
+        hashes.store_many(hashed_files)
+        helpers.sync_to_disk([__get_journaled_file(key).parent for key in entries] + [file for file in [config.HASHES_FILE, config.BACKUPS_FILE] if file.exists()])
+        journal.discard()
+    directories = {file.parent for file in get_patched_files()} | {config.HEPHAISTOS_DATA_DIR, *directories}
+    for directory in directories:
+        for temporary_file in directory.glob(f'*{config.TEMPORARY_SUFFIX}'):
+            temporary_file.unlink()
+            LOGGER.debug(f"Discarded '{temporary_file}' left behind by an interrupted run")
+
+
+def __get_journaled_file(key: str) -> Path:
+    # journal records absolute paths, while Hades directory may be relative
+    file = Path(key)
+    with contextlib.suppress(ValueError):
+        return config.hades_dir.joinpath(file.relative_to(config.hades_dir.absolute()))
+    return file
+
+
+def __get_temporary_file(file: Path) -> Path:
+    return file.with_name(file.name + config.TEMPORARY_SUFFIX)
+
+
+def __is_up_to_date(file: Path) -> bool:
+    """If only updating (see `update` subcommand), files which were not modified
+    since they were last patched are up to date, as they were patched with the
+    same parameters."""
+    if not config.update_only:
+        return False
+    try:
+        if hashes.check(file):
+            LOGGER.info(f"'{file}' was not modified since last patch: skipping")
+            return True
+    except hashes.HashMismatch:
+        LOGGER.info(f"'{file}' was modified since last patch: re-patching")
+    return False
+
+
+def get_patched_files() -> list[Path]:
+    """Return all engine and SJSON files patched on the current platform."""
+    files = [config.hades_dir.joinpath(filepath) for filepath in ENGINES[config.platform].values()]
+    files += [__get_sjson_file(dirname, filename) for dirname, filename in __get_sjson_items()]
+    return files
+
+
+def check_hashes() -> None:
+    """Check hashes of all engine and SJSON files concurrently before patching,
+    ignoring mismatches if using '--force' (handled file by file instead)."""
+    try:
+        hashes.check_many(get_patched_files())
+    except hashes.HashMismatch:
+        if not config.force:
+            raise
 
 
 class Engine(str, Enum):
@@ -88,6 +398,12 @@ class HexPatch(TypedDict, total=False):
     replacement: str
     replacement_args: tuple[bytes, ...]
     expected_subs: int
+    sections: tuple[str, ...]
+
+
+# PE / Mach-O section names
+CODE_SECTIONS = ('.text', '__text')
+DATA_SECTIONS = ('.rdata', '.data', '__const', '__data', '__literal4', '__literal8', '__literal16')
 
 
 def __int_to_bytes(value: int) -> bytes:
@@ -107,6 +423,7 @@ HEX_PATCHES: dict[str, HexPatch] = {
         'pattern': re.compile(rb'(\xc7.{5})' + __int_to_bytes(config.DEFAULT_SCREEN.width) + rb'(\xc7.{5})' + __int_to_bytes(config.DEFAULT_SCREEN.height)),
         'replacement': b'\g<1>%b\g<2>%b',
         'expected_subs': 2,
+        'sections': CODE_SECTIONS,
         Engine.METAL: {
             'pattern': re.compile(rb'(\x48\xb8.{4})?' +__int_to_bytes(config.DEFAULT_SCREEN.width) + rb'(.{14}\xc7\x05.{4})?' + __int_to_bytes(config.DEFAULT_SCREEN.height)),
         },
@@ -119,6 +436,7 @@ HEX_PATCHES: dict[str, HexPatch] = {
         'pattern': re.compile(__float_to_bytes(config.DEFAULT_SCREEN.width) + __float_to_bytes(config.DEFAULT_SCREEN.height)),
         'replacement': b'%b%b',
         'expected_subs': 245,
+        'sections': CODE_SECTIONS + DATA_SECTIONS,
         Engine.DIRECTX32: {
             'expected_subs': 244,
         },
@@ -137,6 +455,7 @@ HEX_PATCHES: dict[str, HexPatch] = {
         'pattern': re.compile(__float_to_bytes(config.DEFAULT_SCREEN.height) + rb'(' + __float_to_bytes(1440) + __float_to_bytes(1632) + rb')' + __float_to_bytes(config.DEFAULT_SCREEN.width)),
         'replacement': b'%b\g<1>%b',
         'expected_subs': 1,
+        'sections': DATA_SECTIONS,
         Engine.DIRECTX32: {
             'pattern': re.compile(__float_to_bytes(config.DEFAULT_SCREEN.height) + rb'(' + __float_to_bytes(1250) + __float_to_bytes(1440) + __float_to_bytes(1600) + __float_to_bytes(1632) + rb')' + __float_to_bytes(config.DEFAULT_SCREEN.width)),
         },
@@ -152,6 +471,7 @@ HEX_PATCHES: dict[str, HexPatch] = {
         'pattern': re.compile(__float_to_bytes(config.DEFAULT_SCREEN.center_x) + __float_to_bytes(config.DEFAULT_SCREEN.center_y)),
         'replacement': b'%b%b',
         'expected_subs': 488,
+        'sections': CODE_SECTIONS + DATA_SECTIONS,
         Engine.DIRECTX64_MS_STORE: {
             'expected_subs': 490,
         },
@@ -175,34 +495,176 @@ def __get_engine_specific_hex_patches(engine) -> None:
     return hex_patches
 
 
-def patch_engines() -> None:
+def __compile_hex_patches(hex_patches: dict[str, HexPatch]) -> re.Pattern:
+    """Combine all hex patches into a single lookahead pattern, so that engines
+    can be scanned in one pass for every offset where any hex patch matches,
+    including offsets within other matches."""
+    return re.compile(b'(?=' + b'|'.join(hex_patch['pattern'].pattern for hex_patch in hex_patches.values()) + b')')
+
+
+PE_SIGNATURE = b'PE\0\0'
+MACHO_MAGICS = {
+    b'\xce\xfa\xed\xfe': False, # 32-bit
+    b'\xcf\xfa\xed\xfe': True, # 64-bit
+}
+MACHO_FAT_MAGIC = b'\xca\xfe\xba\xbe'
+MACHO_LC_SEGMENT = 0x1
+MACHO_LC_SEGMENT_64 = 0x19
+MACHO_ZEROFILL_SECTION_TYPES = {0x1, 0xc, 0x12}
+Sections = dict[str, list[tuple[int, int]]]
+
+
+def __get_sections(data: mmap.mmap) -> Sections:
+    """Return file offset ranges of sections by name if engine is a PE or Mach-O
+    binary, or None otherwise."""
+    try:
+        if data[:2] == b'MZ':
+            return __get_pe_sections(data)
+        elif data[:4] in MACHO_MAGICS:
+            return __get_macho_sections(data, 0, {})
+        elif data[:4] == MACHO_FAT_MAGIC:
+            # universal binaries contain one Mach-O binary per architecture
+            sections = {}
+            (nfat_arch,) = struct.unpack_from('>I', data, 4)
+            for index in range(nfat_arch):
+                (_, _, offset, _, _) = struct.unpack_from('>iiIII', data, 8 + 20 * index)
+                __get_macho_sections(data, offset, sections)
+            return sections
+    except (struct.error, ValueError) as e:
+        LOGGER.debug(f"Failed to parse engine sections: {e}")
+    return None
+
+
+def __get_pe_sections(data: mmap.mmap) -> Sections:
+    (pe_offset,) = struct.unpack_from('<I', data, 0x3c)
+    if data[pe_offset:pe_offset + 4] != PE_SIGNATURE:
+        raise ValueError("missing PE signature")
+    (number_of_sections,) = struct.unpack_from('<H', data, pe_offset + 6)
+    (size_of_optional_header,) = struct.unpack_from('<H', data, pe_offset + 20)
+    section_table = pe_offset + 24 + size_of_optional_header
+    sections = {}
+    for index in range(number_of_sections):
+        (name, _, _, size_of_raw_data, pointer_to_raw_data) = struct.unpack_from('<8sIIII', data, section_table + 40 * index)
+        name = name.rstrip(b'\0').decode('ascii', errors='replace')
+        sections.setdefault(name, []).append((pointer_to_raw_data, pointer_to_raw_data + size_of_raw_data))
+    return sections
+
+
+def __get_macho_sections(data: mmap.mmap, base: int, sections: Sections) -> Sections:
+    is_64_bit = MACHO_MAGICS.get(data[base:base + 4])
+    if is_64_bit is None:
+        raise ValueError(f"missing Mach-O magic at {base}")
+    (ncmds,) = struct.unpack_from('<I', data, base + 16)
+    offset = base + (32 if is_64_bit else 28)
+    for _ in range(ncmds):
+        (cmd, cmdsize) = struct.unpack_from('<II', data, offset)
+        if cmd == MACHO_LC_SEGMENT_64:
+            (nsects,) = struct.unpack_from('<I', data, offset + 64)
+            section_headers = [struct.unpack_from('<16s16sQQI12xI', data, offset + 72 + 80 * index) for index in range(nsects)]
+        elif cmd == MACHO_LC_SEGMENT:
+            (nsects,) = struct.unpack_from('<I', data, offset + 48)
+            section_headers = [struct.unpack_from('<16s16sIII12xI', data, offset + 56 + 68 * index) for index in range(nsects)]
+        else:
+            section_headers = []
+        for (name, _, _, size, section_offset, flags) in section_headers:
+            # zerofill sections do not occupy any space in the file
+            if flags & 0xff in MACHO_ZEROFILL_SECTION_TYPES:
+                continue
+            name = name.rstrip(b'\0').decode('ascii', errors='replace')
+            sections.setdefault(name, []).append((base + section_offset, base + section_offset + size))
+        offset += cmdsize
+    return sections
+
+
+def __get_scan_ranges(data: mmap.mmap, hex_patches: dict[str, HexPatch]) -> list[tuple[int, int, dict[str, HexPatch]]]:
+    """Split engine into byte ranges to scan, each with the hex patches
+    targeting its sections, or the whole file if no declared section is found."""
+    sections = __get_sections(data) or {}
+    ranges = []
+    unrestricted = {hex_patch_name: hex_patch for hex_patch_name, hex_patch in hex_patches.items() if not any(section in sections for section in hex_patch.get('sections', ()))}
+    if unrestricted:
+        ranges.append((0, len(data), unrestricted))
+    for section, section_ranges in sections.items():
+        targeting = {hex_patch_name: hex_patch for hex_patch_name, hex_patch in hex_patches.items() if hex_patch_name not in unrestricted and section in hex_patch.get('sections', ())}
+        if targeting:
+            ranges += [(start, min(end, len(data)), targeting) for (start, end) in section_ranges]
+    return ranges
+
+
+def __configure_hex_patches() -> None:
     HEX_PATCHES['viewport']['replacement_args'] = (__int_to_bytes(config.new_screen.width), __int_to_bytes(config.new_screen.height))
     HEX_PATCHES['fullscreen_vector']['replacement_args'] = (__float_to_bytes(config.new_screen.width), __float_to_bytes(config.new_screen.height))
     HEX_PATCHES['width_height_floats']['replacement_args'] = (__float_to_bytes(config.new_screen.height), __float_to_bytes(config.new_screen.width))
     HEX_PATCHES['screencenter_vector']['replacement_args'] = (__float_to_bytes(config.new_screen.center_x), __float_to_bytes(config.new_screen.center_y))
-    for engine, filepath in ENGINES[config.platform].items():
-        hex_patches = __get_engine_specific_hex_patches(engine)
-        file = config.hades_dir.joinpath(filepath)
-        LOGGER.debug(f"Patching '{engine}' backend at '{file}'")
-        got_any_warnings = False
-        with safe_patch_file(file) as (original_file, file):
-            if not __patch_engine(original_file, file, engine, hex_patches):
-                got_any_warnings = True
-    if got_any_warnings:
+
+
+def patch_engines() -> None:
+    __configure_hex_patches()
+    items = [(engine, filepath) for engine, filepath in ENGINES[config.platform].items() if not __is_up_to_date(config.hades_dir.joinpath(filepath))]
+    # engines are independent from each other and patched concurrently
+    with transaction():
+        all_as_expected = helpers.run_concurrently(__patch_engine_file, items)
+    __warn_if_not_as_expected(all_as_expected)
+
+
+def prepare_engines(target_dir: Path) -> None:
+    """Patch engine files from their backups into `target_dir` (mirroring
+    their paths relative to Hades directory), leaving Hades files untouched."""
+    __configure_hex_patches()
+    items = [(engine, filepath, target_dir) for engine, filepath in ENGINES[config.platform].items()]
+    with transaction():
+        all_as_expected = helpers.run_concurrently(__prepare_engine_file, items)
+    __warn_if_not_as_expected(all_as_expected)
+
+
+def __warn_if_not_as_expected(all_as_expected: list[bool]) -> None:
+    if not all(all_as_expected):
         LOGGER.warning("Hephaistos managed to apply all hex patches but did not patch everything exactly as expected.")
         LOGGER.warning("This is most probably due to a game update.")
         LOGGER.warning("In most cases this is inconsequential and Hephaistos will work anyway, but Hephaistos might need further changes to work properly with the new version of the game.")
 
 
-def __patch_engine(original_file: Path, file: Path, engine: str, hex_patches: dict[str, HexPatch]
+def __patch_engine_file(engine: Engine, filepath: str) -> bool:
+    hex_patches = __get_engine_specific_hex_patches(engine)
+    file = config.hades_dir.joinpath(filepath)
+    LOGGER.debug(f"Patching '{engine}' backend at '{file}'")
+    with safe_patch_file(file, delta_backup=config.delta_engine_backups) as (original_file, file):
+        return __patch_engine(original_file, file, engine, hex_patches)
+
+
+def __prepare_engine_file(engine: Engine, filepath: str, target_dir: Path) -> bool:
+    hex_patches = __get_engine_specific_hex_patches(engine)
+    file = config.hades_dir.joinpath(filepath)
+    destination = target_dir.joinpath(filepath)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    LOGGER.debug(f"Preparing '{engine}' backend at '{destination}'")
+    original_file = backups.get(file)
+    try:
+        return __patch_engine(original_file, file, engine, hex_patches, destination)
+    finally:
+        backups.release(original_file)
+
+
+def __patch_engine(original_file: Path, file: Path, engine: str, hex_patches: dict[str, HexPatch], destination: Path=None
 ) -> bool:
-    """Return True if patch went as expected, False if any warnings happened."""
-    data = original_file.read_bytes()
+    """Return True if patch went as expected, False if any warnings happened.
+    Patched engine is written to `destination` if provided, or else to `file`."""
+    replacements = {hex_patch_name: hex_patch['replacement'] % hex_patch['replacement_args'] for hex_patch_name, hex_patch in hex_patches.items()}
+    # original digest is known from backups, without reading the whole file
+    digest = backups.digest(file)
+    with original_file.open('rb') as original, mmap.mmap(original.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        offsets = engine_offsets.get(file, digest)
+        matches = __rematch_engine(data, hex_patches, replacements, offsets) if offsets else None
+        if matches is None:
+            matches = __scan_engine(data, hex_patches, replacements)
+            offsets = None
+        else:
+            LOGGER.debug(f"Reusing engine offsets stored for '{file}'")
     all_as_expected = True
     for hex_patch_name, hex_patch in hex_patches.items():
-        replacement = hex_patch['replacement'] % hex_patch['replacement_args']
+        replacement = replacements[hex_patch_name]
         pattern = hex_patch['pattern']
-        (data, sub_count) = pattern.subn(replacement, data)
+        sub_count = len(matches[hex_patch_name])
         LOGGER.debug(f"Replaced {sub_count} occurrences of '{hex_patch_name}' pattern {pattern.pattern} with {replacement} in '{file}'")
         expected = hex_patch['expected_subs']
         if sub_count == 0 and expected != 0:
@@ -210,23 +672,140 @@ def __patch_engine(original_file: Path, file: Path, engine: str, hex_patches: di
         elif sub_count != expected:
             LOGGER.warning(f"Expected {expected} matches for '{hex_patch_name}' patch in '{file}', found {sub_count}")
             all_as_expected = False
-    file.write_bytes(data)
-    LOGGER.info(f"Patched '{file}'")
+    if offsets is None:
+        engine_offsets.store(file, digest, {hex_patch_name: [(offset, len(patched_bytes)) for offset, patched_bytes in hex_patch_matches] for hex_patch_name, hex_patch_matches in matches.items()})
+    destination = destination or file
+    if __is_engine_patched(original_file, destination, matches):
+        LOGGER.debug(f"'{destination}' is already identical to its patched output: left untouched")
+        skipped_files.add(destination)
+        return all_as_expected
+    temporary_file = __get_temporary_file(destination)
+    shutil.copyfile(original_file, temporary_file)
+    with temporary_file.open('r+b') as patched, mmap.mmap(patched.fileno(), 0) as data:
+        for hex_patch_matches in matches.values():
+            for offset, patched_bytes in hex_patch_matches:
+                data[offset:offset + len(patched_bytes)] = patched_bytes
+        data.flush()
+    hashes.forget(temporary_file)
+    __pending.setdefault(destination, False)
+    LOGGER.info(f"Patched '{destination}'")
     return all_as_expected
 
 
+# engines are compared in chunks rather than in full, so that memory usage does
+# not grow with engine size
+COMPARE_CHUNK_SIZE = 1024 * 1024
+
+
+def __is_engine_patched(original_file: Path, file: Path, matches: dict[str, list[tuple[int, bytes]]]) -> bool:
+    """Check if `file` is already identical to `original_file` with `matches`
+    applied, without writing anything."""
+    if not file.exists() or file.stat().st_size != original_file.stat().st_size or file.stat().st_size == 0:
+        return False
+    patches = sorted((offset, patched_bytes) for hex_patch_matches in matches.values() for offset, patched_bytes in hex_patch_matches)
+    with original_file.open('rb') as original_handle, file.open('rb') as current_handle, \
+        mmap.mmap(original_handle.fileno(), 0, access=mmap.ACCESS_READ) as original, \
+        mmap.mmap(current_handle.fileno(), 0, access=mmap.ACCESS_READ) as current:
+        position = 0
+        for offset, patched_bytes in patches + [(len(original), b'')]:
+            for start in range(position, offset, COMPARE_CHUNK_SIZE):
+                end = min(start + COMPARE_CHUNK_SIZE, offset)
+                if original[start:end] != current[start:end]:
+                    return False
+            if current[offset:offset + len(patched_bytes)] != patched_bytes:
+                return False
+            position = offset + len(patched_bytes)
+    return True
+
+
+def __scan_engine(data: mmap.mmap, hex_patches: dict[str, HexPatch], replacements: dict[str, bytes]) -> dict[str, list[tuple[int, bytes]]]:
+    """Find all hex patches matches in a single pass over the sections they
+    target, and return the offset and patched bytes of each match, grouped by
+    hex patch, as if hex patches were applied one after the other."""
+    scan_ranges = __get_scan_ranges(data, hex_patches)
+    LOGGER.debug(f"Scanning {sum(end - start for (start, end, _) in scan_ranges)} out of {len(data)} bytes")
+    candidates = {hex_patch_name: [] for hex_patch_name in hex_patches}
+    for (start, end, targeting) in scan_ranges:
+        for match in __compile_hex_patches(targeting).finditer(data, start, end):
+            for hex_patch_name, hex_patch in targeting.items():
+                hex_patch_match = hex_patch['pattern'].match(data, match.start(), end)
+                if hex_patch_match is not None:
+                    candidates[hex_patch_name].append(hex_patch_match)
+    matches = {hex_patch_name: [] for hex_patch_name in hex_patches}
+    spans = []
+    for hex_patch_name, hex_patch_candidates in candidates.items():
+        # same as `re.finditer`: leftmost matches, not overlapping each other
+        position = 0
+        for match in hex_patch_candidates:
+            if match.start() >= position:
+                matches[hex_patch_name].append((match.start(), __expand(hex_patch_name, match, replacements)))
+                position = match.end()
+        spans += [(match.start(), match.end(), hex_patch_name) for match in hex_patch_candidates]
+    # where matches of different hex patches overlap, whether the latter still
+    # matches depends on bytes replaced by the former: fall back to applying
+    # hex patches one after the other on a copy of the engine (replacements of
+    # shipped hex patches only create new matches where matches overlap)
+    spans.sort()
+    for (_, previous_end, previous_name), (start, _, name) in zip(spans, spans[1:]):
+        if start < previous_end and name != previous_name:
+            LOGGER.debug(f"Found overlapping '{previous_name}' and '{name}' matches: applying hex patches one after the other")
+            return __scan_engine_sequentially(data, hex_patches, replacements, scan_ranges)
+    return matches
+
+
+def __scan_engine_sequentially(data: mmap.mmap, hex_patches: dict[str, HexPatch], replacements: dict[str, bytes], scan_ranges: list[tuple[int, int, dict[str, HexPatch]]]) -> dict[str, list[tuple[int, bytes]]]:
+    patched = bytearray(data)
+    matches = {hex_patch_name: [] for hex_patch_name in hex_patches}
+    for hex_patch_name, hex_patch in hex_patches.items():
+        for (start, end, targeting) in scan_ranges:
+            if hex_patch_name in targeting:
+                for match in list(hex_patch['pattern'].finditer(patched, start, end)):
+                    patched_bytes = __expand(hex_patch_name, match, replacements)
+                    patched[match.start():match.end()] = patched_bytes
+                    matches[hex_patch_name].append((match.start(), patched_bytes))
+    return matches
+
+
+def __expand(hex_patch_name: str, match: re.Match, replacements: dict[str, bytes]) -> bytes:
+    patched_bytes = match.expand(replacements[hex_patch_name])
+    if len(patched_bytes) != len(match.group()):
+        raise ValueError(f"'{hex_patch_name}' replacement {patched_bytes} does not have the same length as {match.group()}")
+    return patched_bytes
+
+
+def __rematch_engine(data: mmap.mmap, hex_patches: dict[str, HexPatch], replacements: dict[str, bytes], offsets: dict[str, list[tuple[int, int]]]) -> dict[str, list[tuple[int, bytes]]]:
+    """Same as `__scan_engine`, but only matching at known offsets. Return None
+    if offsets do not match the current hex patches."""
+    if offsets.keys() != hex_patches.keys():
+        return None
+    matches = {hex_patch_name: [] for hex_patch_name in hex_patches}
+    for hex_patch_name, hex_patch_offsets in offsets.items():
+        for offset, length in hex_patch_offsets:
+            match = hex_patches[hex_patch_name]['pattern'].fullmatch(data, offset, offset + length)
+            if match is None:
+                return None
+            matches[hex_patch_name].append((offset, match.expand(replacements[hex_patch_name])))
+    return matches
+
+
 def patch_engines_status() -> None:
     status = True
+    files = [config.hades_dir.joinpath(filepath) for filepath in ENGINES[config.platform].values()]
+    try:
+        # hash engines concurrently, mismatches are reported engine by engine
+        hashes.check_many(files, refresh=False)
+    except hashes.HashMismatch:
+        pass
     for engine, filepath in ENGINES[config.platform].items():
         file = config.hades_dir.joinpath(filepath)
         LOGGER.debug(f"Checking patch status of '{engine}' backend at '{file}'")
         try:
-            with safe_patch_file(file, store_backup=False) as (original_file, file):
-                if original_file is not None:
-                    LOGGER.info(f"'{file}' looks patched")
-                else:
-                    status = False
-                    LOGGER.info(f"'{file}' is not patched")
+            # only check that a backup exists, as extracting it may be slow
+            if hashes.check(file, refresh=False) and backups.exists(file):
+                LOGGER.info(f"'{file}' looks patched")
+            else:
+                status = False
+                LOGGER.info(f"'{file}' is not patched")
         except hashes.HashMismatch:
             status = False
             LOGGER.info(f"'{file}' has been modified since last backup: probably not patched")
@@ -234,31 +813,28 @@ def patch_engines_status() -> None:
 
 
 def __update_children(children_dict: dict, data: dict) -> dict:
-    patched = copy.deepcopy(data)
     for child_key, callback in children_dict.items():
         try:
-            child_value = copy.deepcopy(patched[child_key])
-            patched[child_key] = callback(patched[child_key])
-            LOGGER.debug(f"Updated child '{child_key}' from '{child_value}' to '{patched[child_key]}'")
+            child_value = str(data[child_key])
+            data[child_key] = callback(data[child_key])
+            LOGGER.debug(f"Updated child '{child_key}' from '{child_value}' to '{data[child_key]}'")
         except KeyError:
             raise KeyError(f"Did not find '{child_key}'.")
-    return patched
+    return data
 
 
 def __upsert_siblings(lookup_key: str, lookup_value: str, sibling_dict: dict, data: dict) -> dict:
     try:
         if data[lookup_key] == lookup_value:
-            patched = copy.deepcopy(data)
             for sibling_key, (callback, default) in sibling_dict.items():
                 try:
-                    sibling_value = copy.deepcopy(patched[sibling_key])
-                    patched[sibling_key] = callback(patched[sibling_key])
-                    LOGGER.debug(f"Found '{lookup_key} = {lookup_value}', updated sibling '{sibling_key}' from '{sibling_value}' to '{patched[sibling_key]}'")
+                    sibling_value = str(data[sibling_key])
+                    data[sibling_key] = callback(data[sibling_key])
+                    LOGGER.debug(f"Found '{lookup_key} = {lookup_value}', updated sibling '{sibling_key}' from '{sibling_value}' to '{data[sibling_key]}'")
                 except KeyError:
                     if default:
-                        patched[sibling_key] = callback(default)
-                        LOGGER.debug(f"Found '{lookup_key} = {lookup_value}', inserted sibling '{sibling_key} = {patched[sibling_key]}'")
-            return patched
+                        data[sibling_key] = callback(default)
+                        LOGGER.debug(f"Found '{lookup_key} = {lookup_value}', inserted sibling '{sibling_key} = {data[sibling_key]}'")
         return data
     except KeyError:
         return data
@@ -721,47 +1297,236 @@ SJSON_DIR = 'Game'
 
 def patch_sjsons() -> None:
     LOGGER.info("Reading SJSON data (this operation can take time, please be patient)")
-    sjson_dir = config.content_dir.joinpath(SJSON_DIR)
-    for dirname, files in SJON_PATCHES.items():
-        sub_dir = sjson_dir.joinpath(dirname)
-        for filename, patches in files.items():
-            file = sub_dir.joinpath(filename)
-            LOGGER.debug(f"Patching SJSON file at '{file}'")
-            with safe_patch_file(file) as (source_sjson, file):
-                __patch_sjson_file(source_sjson, file, patches)
+    # SJSON files are independent from each other, and parsing / serializing
+    # them is CPU-bound, so they are patched concurrently in worker processes
+    items = [item for item in __get_sjson_items() if not __is_up_to_date(__get_sjson_file(*item))]
+    with transaction():
+        results = helpers.run_concurrently(__patch_sjson, items, processes=True, return_exceptions=True)
+        # written files are registered from here, as workers may be processes,
+        # and their hashes are stored at once when committed
+        for item, result in zip(items, results):
+            if result is True:
+                __pending[__get_sjson_file(*item)] = True
+        # files left untouched are reported from here for the same reason
+        untouched_files = [__get_sjson_file(*item) for item, result in zip(items, results) if result is False]
+        hashes.store_many(untouched_files)
+        skipped_files.update(untouched_files)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+def prepare_sjsons(target_dir: Path) -> None:
+    """Patch SJSON files from their backups into `target_dir` (mirroring their
+    paths relative to Hades directory), leaving Hades files untouched."""
+    items = [(dirname, filename, target_dir) for dirname, filename in __get_sjson_items()]
+    with transaction():
+        results = helpers.run_concurrently(__prepare_sjson, items, processes=True)
+        for item, result in zip(items, results):
+            if result:
+                __pending.setdefault(target_dir.joinpath(__get_sjson_file(*item[:2]).relative_to(config.hades_dir)), False)
+
+
+def __get_sjson_items() -> list[tuple[str, str]]:
+    return [(dirname, filename) for dirname, files in SJON_PATCHES.items() for filename in files]
+
+
+def __get_sjson_file(dirname: str, filename: str) -> Path:
+    return config.content_dir.joinpath(SJSON_DIR, dirname, filename)
+
+
+def __patch_sjson(dirname: str, filename: str) -> bool:
+    file = __get_sjson_file(dirname, filename)
+    LOGGER.debug(f"Patching SJSON file at '{file}'")
+    with safe_patch_file(file, store_hash=False) as (original_file, file):
+        return __patch_sjson_file(original_file, file, SJON_PATCHES[dirname][filename])
+
+
+def __prepare_sjson(dirname: str, filename: str, target_dir: Path) -> bool:
+    file = __get_sjson_file(dirname, filename)
+    destination = target_dir.joinpath(file.relative_to(config.hades_dir))
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    LOGGER.debug(f"Preparing SJSON file at '{destination}'")
+    original_file = backups.get(file)
+    try:
+        return __patch_sjson_file(original_file, file, SJON_PATCHES[dirname][filename], destination)
+    finally:
+        backups.release(original_file)
+
 
+class SJSONSpliceError(ValueError): ...
 
-def __patch_sjson_file(source_sjson: SJSON, file: Path, patches: SJSONPatch) -> None:
-    patched_sjson = __patch_sjson_data(source_sjson, patches)
-    file.write_text(sjson.dumps(patched_sjson))
-    LOGGER.info(f"Patched '{file}'")
+
+def __patch_sjson_file(original_file: Path, file: Path, patches: SJSONPatch, destination: Path=None) -> bool:
+    """Patch SJSON `file` from `original_file` into `destination` (or else
+    `file`), splicing patched values into the original text if possible."""
+    destination = destination or file
+    text = __read_sjson_text(original_file)
+    source_sjson = sjson_parser.loads(text, __get_sjson_paths(patches), spans=True)
+    patched_sjson = __patch_sjson_data(source_sjson, patches, file.name)
+    try:
+        written = __write_spliced_sjson(text, patched_sjson, destination)
+    except SJSONSpliceError as e:
+        LOGGER.debug(f"Cannot splice patches into '{file}' ({e}): serializing whole SJSON data instead")
+        source_sjson = sjson_data.get(file, original_file)
+        patched_sjson = __patch_sjson_data(source_sjson, patches, file.name)
+        written = __write_sjson(patched_sjson, destination)
+    if written:
+        LOGGER.info(f"Patched '{destination}'")
+    return written
+
+
+def __read_sjson_text(file: Path) -> str:
+    # line endings are kept as is, so that they are left untouched by splicing
+    with file.open(newline='') as file_handle:
+        return file_handle.read()
+
+
+def __write_spliced_sjson(text: str, data: SJSON, file: Path) -> bool:
+    """Write `text` to `file` with changes made to `data` (parsed from `text`
+    with spans) spliced in, or raise `SJSONSpliceError` before writing anything."""
+    edits = __get_sjson_edits(text, data)
+    def write_edits(file_handle: TextIO) -> None:
+        position = 0
+        for start, end, replacement in edits:
+            file_handle.write(text[position:start])
+            file_handle.write(replacement)
+            position = end
+        file_handle.write(text[position:])
+    written = write_file(file, write_edits, newline='')
+    LOGGER.debug(f"Spliced {len(edits)} edits into '{file}'")
+    return written
+
+
+def __get_sjson_paths(patch: SJSONPatch) -> sjson_parser.Paths:
+    """Get paths to materialize from SJSON data for applying `patch`: lists
+    patched with `__upsert_siblings` only need items with matching lookup
+    values."""
+    if isinstance(patch, dict):
+        return {key: __get_sjson_paths(patches) for key, patches in patch.items()}
+    elif isinstance(patch, list):
+        indexed_patches = __index_list_patches(patch)
+        if indexed_patches is not None:
+            return sjson_parser.ItemFilter({lookup_key: set(patches_by_value) for lookup_key, patches_by_value in indexed_patches.items()})
+    return patch
+
+
+def __get_sjson_edits(text: str, data: SJSON, newline: str=None) -> list[tuple[int, int, str]]:
+    """Return sorted `(start, end, replacement)` edits to `text` from changes to
+    scalars in `data` (parsed with spans), or raise `SJSONSpliceError`."""
+    # inserted keys use the same line endings as the rest of the text
+    newline = newline or ('\r\n' if '\r\n' in text else '\n')
+    edits = []
+    if isinstance(data, sjson_parser.SpannedDict):
+        if not data.originals.keys() <= data.keys():
+            raise SJSONSpliceError("removed keys")
+        inserted = []
+        for key, value in data.items():
+            if key not in data.originals:
+                if key in data.skipped:
+                    raise SJSONSpliceError(f"inserted '{key}' over skipped key")
+                inserted.append(f"{__encode_sjson_key(key)} = {__encode_sjson_scalar(value)}{newline}")
+            else:
+                edits += __get_sjson_value_edits(text, value, data.originals[key], data.spans[key], newline)
+        if inserted:
+            prefix = '' if text[data.end - 1:data.end] == '\n' else newline
+            edits.append((data.end, data.end, prefix + ''.join(inserted)))
+    elif isinstance(data, sjson_parser.SpannedList):
+        if len(data) != len(data.originals):
+            raise SJSONSpliceError("resized list")
+        for value, original, span in zip(data, data.originals, data.spans):
+            edits += __get_sjson_value_edits(text, value, original, span, newline)
+    edits.sort(key=lambda edit: edit[:2])
+    return edits
+
+
+def __get_sjson_value_edits(text: str, value: SJSON, original: SJSON, span: tuple[int, int], newline: str) -> list[tuple[int, int, str]]:
+    if value is original:
+        return __get_sjson_edits(text, value, newline) if isinstance(value, (dict, list)) else []
+    elif isinstance(value, (dict, list)) or isinstance(original, (dict, list)):
+        raise SJSONSpliceError("replaced dictionary or list")
+    elif type(value) is type(original) and value == original:
+        return []
+    return [(*span, __encode_sjson_scalar(value))]
+
+
+def __encode_sjson_key(key: str) -> str:
+    return key if re.fullmatch(r'[A-Za-z0-9_]+', key) else __encode_sjson_scalar(key)
+
+
+def __encode_sjson_scalar(value: SJSON) -> str:
+    if isinstance(value, (dict, list)):
+        raise SJSONSpliceError("inserted dictionary or list")
+    # same representation as when serializing whole SJSON data
+    return sjson.dumps(value)
+
+
+def __write_sjson(data: SJSON, file: Path) -> bool:
+    """Stream `data` serialized as with `sjson.dumps` to `file`, without holding
+    the whole document in memory, and return True if `file` was written."""
+    return write_file(file, partial(sjson.dump, data))
 
 
 @singledispatch
 def __patch_sjson_data(data: dict, patch: Union[dict[str, SJSONPatch], Callable], previous_path: str=None) -> SJSON:
-    patched = copy.deepcopy(data)
+    """Patch SJSON data in place and return it. SJSON data is always freshly
+    parsed or loaded from `sjson_data`, so there is no need to work on a copy."""
     if isinstance(patch, dict):
         for key, patches in patch.items():
             current_path = key if previous_path is None else f'{previous_path}.{key}'
-            patched[key] = __patch_sjson_data(patched[key], patches, current_path)
+            data[key] = __patch_sjson_data(data[key], patches, current_path)
+        return data
     else:
         LOGGER.debug(f"Patching '{previous_path}'")
-        patched = patch(data=patched)
-    return patched
+        return patch(data=data)
 
 
 @__patch_sjson_data.register
 def _(data: list, patches: list[Callable], previous_path: str=None) -> SJSON:
-    patched = copy.deepcopy(data)
     current_path = '[]' if previous_path is None else f'{previous_path}.[]'
     LOGGER.debug(f"Patching '{current_path}'")
+    indexed_patches = __index_list_patches(patches)
+    if indexed_patches is None:
+        for patch in patches:
+            for index, item in enumerate(data):
+                data[index] = patch(data=item)
+        return data
+    # visit each item once, dispatching it to its own patches (if any)
+    found = {lookup_key: set() for lookup_key in indexed_patches}
+    for index, item in enumerate(data):
+        for lookup_key, patches_by_value in indexed_patches.items():
+            try:
+                lookup_value = item[lookup_key]
+                item_patches = patches_by_value.get(lookup_value, [])
+            except (KeyError, TypeError):
+                continue
+            if item_patches:
+                found[lookup_key].add(lookup_value)
+            for patch in item_patches:
+                item = patch(data=item)
+        data[index] = item
+    for lookup_key, patches_by_value in indexed_patches.items():
+        LOGGER.debug(f"Found {len(found[lookup_key])} out of {len(patches_by_value)} '{lookup_key}' values to patch in '{current_path}'")
+        for lookup_value in patches_by_value.keys() - found[lookup_key]:
+            LOGGER.warning(f"Did not find '{lookup_key} = {lookup_value}' in '{current_path}'")
+    return data
+
+
+def __index_list_patches(patches: list[Callable]) -> dict[str, dict[Any, list[Callable]]]:
+    """Index `__upsert_siblings` patches by lookup key and lookup value, or
+    return None if any patch is not an `__upsert_siblings` patch."""
+    indexed_patches: dict[str, dict[Any, list[Callable]]] = {}
     for patch in patches:
-        patched = [patch(data=item) for item in patched]
-    return patched
+        if not isinstance(patch, partial) or patch.func is not __upsert_siblings:
+            return None
+        (lookup_key, lookup_value, _) = patch.args
+        indexed_patches.setdefault(lookup_key, {}).setdefault(lookup_value, []).append(patch)
+    return indexed_patches
 
 
 WINDOW_XY_DEFAULT_OFFSET = 100
 WINDOW_XY_OVERFLOW_THRESHOLD = 32767
+PROFILE_SJSON_PATHS = dict.fromkeys(['X', 'Y', 'WindowWidth', 'WindowHeight', 'WindowX', 'WindowY'])
 
 
 def patch_profile_sjsons() -> None:
@@ -775,32 +1540,49 @@ In this case, you should start a game to create a new save file first, and then
             LOGGER.warning(msg)
             return
         edited_list = []
-        for file in profile_sjsons:
-            LOGGER.debug(f"Analyzing '{file}'")
-            data = sjson.loads(file.read_text())
-            for key in ['X', 'WindowWidth']:
-                data[key] = config.resolution.width
-            for key in ['Y', 'WindowHeight']:
-                data[key] = config.resolution.height
-            # we manually set WindowX/Y in ProfileX.sjson configuration files as a
-            # safeguard against WindowX/Y values overflowing when switching to
-            # windowed mode while using a custom resolution larger than officially
-            # supported by the main monitor, ensuring Hades will not be drawn
-            # offscreen and can then be repositioned by the user
-            for key in ['WindowX', 'WindowY']:
-                if not key in data:
-                    data[key] = WINDOW_XY_DEFAULT_OFFSET
-                    LOGGER.debug(f"'{key}' not found in '{file.name}', inserted '{key} = {WINDOW_XY_DEFAULT_OFFSET}'")
-                elif data[key] >= WINDOW_XY_OVERFLOW_THRESHOLD:
-                    data[key] = WINDOW_XY_DEFAULT_OFFSET
-                    LOGGER.debug(f"'{key}' found in '{file.name}' but with overflowed value, reset to '{key} = {WINDOW_XY_DEFAULT_OFFSET}'")
-            file.write_text(sjson.dumps(data))
-            edited_list.append(file)
+        with transaction():
+            for file in profile_sjsons:
+                LOGGER.debug(f"Analyzing '{file}'")
+                # only parse and rewrite the resolution keys, as save files can
+                # be large
+                text = __read_sjson_text(file)
+                data = sjson_parser.loads(text, PROFILE_SJSON_PATHS, spans=True)
+                __patch_profile_sjson_data(data, file)
+                try:
+                    written = __write_spliced_sjson(text, data, file)
+                except SJSONSpliceError as e:
+                    LOGGER.debug(f"Cannot splice custom resolution into '{file}' ({e}): serializing whole SJSON data instead")
+                    data = sjson_parser.loads(text)
+                    __patch_profile_sjson_data(data, file)
+                    written = __write_sjson(data, file)
+                if written:
+                    edited_list.append(file)
         if edited_list:
             edited_list = '\n'.join(f"  - {file}" for file in edited_list)
             msg = f"""Applied custom resolution to:
 {edited_list}"""
             LOGGER.info(msg)
+        else:
+            LOGGER.info("Custom resolution was already applied to all 'ProfileX.sjson' files")
+
+
+def __patch_profile_sjson_data(data: dict, file: Path) -> None:
+    for key in ['X', 'WindowWidth']:
+        data[key] = config.resolution.width
+    for key in ['Y', 'WindowHeight']:
+        data[key] = config.resolution.height
+    # we manually set WindowX/Y in ProfileX.sjson configuration files as a
+    # safeguard against WindowX/Y values overflowing when switching to
+    # windowed mode while using a custom resolution larger than officially
+    # supported by the main monitor, ensuring Hades will not be drawn
+    # offscreen and can then be repositioned by the user
+    for key in ['WindowX', 'WindowY']:
+        if not key in data:
+            data[key] = WINDOW_XY_DEFAULT_OFFSET
+            LOGGER.debug(f"'{key}' not found in '{file.name}', inserted '{key} = {WINDOW_XY_DEFAULT_OFFSET}'")
+        elif data[key] >= WINDOW_XY_OVERFLOW_THRESHOLD:
+            data[key] = WINDOW_XY_DEFAULT_OFFSET
+            LOGGER.debug(f"'{key}' found in '{file.name}' but with overflowed value, reset to '{key} = {WINDOW_XY_DEFAULT_OFFSET}'")
 
 
 HOOK_FILE = 'RoomManager.lua'
@@ -808,8 +1590,10 @@ HOOK_FILE = 'RoomManager.lua'
 
 def patch_lua(lua_scripts_dir: Path, import_statement: str) -> None:
     hook_file = lua_scripts_dir.joinpath(HOOK_FILE)
+    if __is_up_to_date(hook_file):
+        return
     LOGGER.debug(f"Patching Lua hook file at '{hook_file}'")
-    with safe_patch_file(hook_file) as (original_file, file):
+    with transaction(), safe_patch_file(hook_file) as (original_file, file):
         __patch_hook_file(original_file, file, import_statement)
 
 
@@ -820,8 +1604,8 @@ def __patch_hook_file(original_file: Path, file: Path, import_statement: str) ->
 -- Hephaistos hook
 {import_statement}
 """
-    file.write_text(source_text)
-    LOGGER.info(f"Patched '{file}' with hook '{import_statement}'")
+    if write_file(file, source_text):
+        LOGGER.info(f"Patched '{file}' with hook '{import_statement}'")
 
 
 def patch_lua_status(lua_scripts_dir: Path, import_statement: str) -> None:
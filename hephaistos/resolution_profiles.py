@@ -0,0 +1,162 @@
+from distutils import dir_util
+import json
+import os
+from pathlib import Path
+import re
+
+from hephaistos import backups, config, hashes, helpers, lua_mod, patch_state, patchers
+from hephaistos.config import LOGGER
+from hephaistos.helpers import Scaling
+
+
+# resolution profiles are files patched ahead of time from backups, so that
+# switching only moves files into place: the active profile's files only live
+# in Hades directory, and are linked back to their profile when switching away
+PROFILE_FILE = 'profile.json'
+FILES_DIR = 'files'
+NAME_REGEX = re.compile(r'[\w.-]+')
+
+
+def prepare(name: str, parameters: dict) -> Path:
+    """Patch all files for `parameters` (resolution, scaling, HUD, custom
+    resolution) from backups into resolution profile `name`, replacing any
+    previous profile with the same name. Hades must already be patched."""
+    __check_name(name)
+    patchers.recover(lua_mod.get_directories())
+    patch_state.get()
+    patchers.check_hashes()
+    profile_dir = __get_dir(name)
+    temporary_dir = profile_dir.with_name(f'{name}.tmp')
+    if temporary_dir.exists():
+        dir_util.remove_tree(str(temporary_dir))
+    files_dir = temporary_dir.joinpath(FILES_DIR)
+    try:
+        with patchers.transaction():
+            patchers.prepare_engines(files_dir)
+            patchers.prepare_sjsons(files_dir)
+            lua_mod.prepare(files_dir)
+        patched_files = [file.relative_to(config.hades_dir).as_posix() for file in patchers.get_patched_files()]
+        files = {}
+        for file in sorted(file for file in files_dir.glob('**/*') if file.is_file()):
+            key = file.relative_to(files_dir).as_posix()
+            stat = file.stat()
+            files[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': hashes.digest(file)}
+            # remember which originals the profile was prepared from, so that
+            # it is not switched to after a game update
+            if key in patched_files:
+                files[key]['original_sha256'] = backups.digest(config.hades_dir.joinpath(key))
+        data = {
+            'version': config.VERSION,
+            'parameters': parameters,
+            'files': files,
+        }
+        temporary_dir.joinpath(PROFILE_FILE).write_text(json.dumps(data, indent=2))
+        if profile_dir.exists():
+            dir_util.remove_tree(str(profile_dir))
+        os.replace(temporary_dir, profile_dir)
+    except BaseException:
+        if temporary_dir.exists():
+            dir_util.remove_tree(str(temporary_dir))
+        raise
+    LOGGER.info(f"Prepared resolution profile '{name}' at '{profile_dir}'")
+    return profile_dir
+
+
+def switch(name: str) -> dict:
+    """Switch Hades files to resolution profile `name` and apply its custom
+    resolution, then return the parameters Hades is now patched with."""
+    __check_name(name)
+    patchers.recover(lua_mod.get_directories())
+    profile_dir = __get_dir(name)
+    profile = __load(name)
+    state_parameters = patch_state.get()
+    if not patch_state.check(state_parameters):
+        raise hashes.HashMismatch("Hades files were modified since last patch.")
+    parameters = {**state_parameters, **profile['parameters']}
+    files = {config.hades_dir.joinpath(key): entry for key, entry in profile['files'].items()}
+    active = patch_state.get_resolution_profile()
+    if active == name:
+        LOGGER.info(f"Resolution profile '{name}' is already active")
+    else:
+        for file, entry in files.items():
+            if 'original_sha256' in entry and backups.digest(file) != entry['original_sha256']:
+                raise LookupError(f"Resolution profile '{name}' was prepared from other original files than the ones backed up (was the game updated?): re-run 'prepare'")
+        if not all(__get_profile_file(profile_dir, file).exists() for file in files):
+            raise LookupError(f"Resolution profile '{name}' is incomplete (was Hades patched again while it was active?): re-run 'prepare'")
+        active_dir = __get_dir(active) if active else None
+        profile_files = {file: __get_profile_file(profile_dir, file) for file in files}
+        # files and patch state are committed at once, so that an interrupted
+        # switch is completed on next run (see `patchers.recover`)
+        with patchers.transaction():
+            for file, entry in files.items():
+                if active_dir and active_dir.exists():
+                    __keep(file, __get_profile_file(active_dir, file))
+                # delta backups are relative to patched files: rebuild
+                # originals before switching, to compute delta backups again
+                original_file = backups.get(file) if backups.is_delta(file) else None
+                patchers.stage_file(profile_files[file], file, entry, store_hash='original_sha256' in entry, original_file=original_file)
+            state = patch_state.serialize(parameters, patchers.get_patched_files() + lua_mod.get_installed_files(), resolution_profile=name, entries=files)
+            patchers.write_file(config.PATCH_STATE_FILE, state)
+        # files of the active profile are only kept in Hades directory
+        for profile_file in profile_files.values():
+            profile_file.unlink()
+        LOGGER.info(f"Switched to resolution profile '{name}'")
+    # 'ProfileX.sjson' files are not part of resolution profiles, as they are
+    # rewritten by the game itself
+    config.custom_resolution = parameters['custom_resolution']
+    helpers.configure_screen_variables(parameters['width'], parameters['height'], Scaling(parameters['scaling']))
+    patchers.patch_profile_sjsons()
+    return parameters
+
+
+def get_names() -> list[str]:
+    if not config.RESOLUTION_PROFILES_DIR.exists():
+        return []
+    return sorted(profile_file.parent.name for profile_file in config.RESOLUTION_PROFILES_DIR.glob(f'*/{PROFILE_FILE}'))
+
+
+def __check_name(name: str) -> None:
+    if not NAME_REGEX.fullmatch(name) or name.endswith('.tmp') or name in ('.', '..'):
+        raise ValueError(f"Invalid resolution profile name '{name}': only use letters, digits, '_', '-' and '.'")
+
+
+def __get_dir(name: str) -> Path:
+    return config.RESOLUTION_PROFILES_DIR.joinpath(name)
+
+
+def __get_profile_file(profile_dir: Path, file: Path) -> Path:
+    return profile_dir.joinpath(FILES_DIR, file.relative_to(config.hades_dir))
+
+
+def __load(name: str) -> dict:
+    profile_file = __get_dir(name).joinpath(PROFILE_FILE)
+    if not profile_file.exists():
+        names = ', '.join(f"'{name}'" for name in get_names()) or 'none'
+        raise LookupError(f"Resolution profile '{name}' not found (available: {names}): use 'prepare' first")
+    try:
+        data = json.loads(profile_file.read_bytes())
+        data['parameters'], data['files']
+    except (ValueError, KeyError, TypeError) as e:
+        raise LookupError(f"Resolution profile file '{profile_file}' is corrupted: re-run 'prepare'") from e
+    if data.get('version') != config.VERSION:
+        raise LookupError(f"Resolution profile '{name}' was prepared with Hephaistos {data.get('version')}: re-run 'prepare'")
+    return data
+
+
+def __keep(file: Path, profile_file: Path) -> None:
+    # active file is hard linked back to its profile directory before being
+    # replaced, so that it does not need to be prepared again
+    if profile_file.exists():
+        return
+    profile_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(file, profile_file)
+    except OSError as e:
+        LOGGER.debug(f"Could not link '{file}' to '{profile_file}', copying instead: {e}")
+        helpers.copy_file(file, profile_file)
+
+
+def discard() -> None:
+    if config.RESOLUTION_PROFILES_DIR.exists():
+        dir_util.remove_tree(str(config.RESOLUTION_PROFILES_DIR))
+        LOGGER.info(f"Discarded resolution profiles at '{config.RESOLUTION_PROFILES_DIR}'")
@@ -1,31 +1,76 @@
+import contextlib
 from distutils import dir_util
-import json
+import gc
+import hashlib
+import marshal
 from pathlib import Path
+import struct
 
-import sjson
-
-from hephaistos import config
+from hephaistos import config, sjson_parser
 from hephaistos.config import LOGGER
 
 
-def get(file: Path) -> dict:
-    sjson_data_file = __get_file(file)
-    if not sjson_data_file.exists():
-        raise LookupError(f"SJSON data file '{sjson_data_file}' is missing")
-    return json.loads(sjson_data_file.read_bytes())
+# SJSON data is cached with `marshal`, which loads several times faster than
+# JSON. Cached files start with a header identifying the cache format and the
+# `marshal` format, so that stale caches (e.g. JSON caches from previous
+# Hephaistos versions) can be detected and rebuilt, followed by the hash of the
+# source file the SJSON data was parsed from.
+MAGIC = b'HSJD'
+FORMAT_VERSION = 2
+HEADER = MAGIC + struct.pack('<HH', FORMAT_VERSION, marshal.version)
+SOURCE_DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+class StaleSJSONData(LookupError): ...
 
 
-def store(file: Path) -> dict:
+def get(file: Path, source_file: Path) -> dict:
+    """Get SJSON data for `file` parsed from `source_file` (i.e. a backup of
+    `file`), from previously stored SJSON data if it was parsed from the same
+    source, or else parse and store it."""
     sjson_data_file = __get_file(file)
-    if sjson_data_file.exists() and not config.force:
-        raise FileExistsError(f"SJSON data file '{sjson_data_file}' already exists")
-    data = sjson.loads(file.read_text())
+    source_digest = hashlib.sha256(source_file.read_bytes()).digest()
+    try:
+        return __load(sjson_data_file, source_digest)
+    except StaleSJSONData as e:
+        LOGGER.debug(f"{e}: parsing SJSON data from '{source_file}'")
+    data = sjson_parser.loads(source_file.read_text())
     sjson_data_file.parent.mkdir(parents=True, exist_ok=True)
-    sjson_data_file.write_text(json.dumps(data))
-    LOGGER.debug(f"Saved SJSON data from '{file}' to '{sjson_data_file}'")
+    sjson_data_file.write_bytes(HEADER + source_digest + marshal.dumps(data))
+    LOGGER.debug(f"Saved SJSON data from '{source_file}' to '{sjson_data_file}'")
     return data
 
 
+def __load(sjson_data_file: Path, source_digest: bytes) -> dict:
+    if not sjson_data_file.exists():
+        raise StaleSJSONData(f"SJSON data file '{sjson_data_file}' is missing")
+    content = sjson_data_file.read_bytes()
+    if not content.startswith(HEADER):
+        raise StaleSJSONData(f"SJSON data file '{sjson_data_file}' was stored in an older format")
+    data_start = len(HEADER) + SOURCE_DIGEST_SIZE
+    if content[len(HEADER):data_start] != source_digest:
+        raise StaleSJSONData(f"SJSON data file '{sjson_data_file}' was stored from another source file")
+    try:
+        with __gc_paused():
+            return marshal.loads(memoryview(content)[data_start:])
+    except (EOFError, ValueError, TypeError) as e:
+        raise StaleSJSONData(f"SJSON data file '{sjson_data_file}' is corrupted") from e
+
+
+@contextlib.contextmanager
+def __gc_paused():
+    # SJSON data is made of hundreds of thousands of small containers, which
+    # would trigger many useless cyclic garbage collections while loading
+    # (there cannot be any reference cycle in SJSON data)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
 def __get_file(file: Path) -> Path:
     config.SJSON_DATA_DIR.mkdir(parents=True, exist_ok=True)
     return config.SJSON_DATA_DIR.joinpath(file.relative_to(config.hades_dir))
@@ -0,0 +1,350 @@
+"""SJSON parser accepting the same grammar as the `sjson` package, tokenizing
+with regular expressions and skipping over subtrees that are not needed."""
+from dataclasses import dataclass
+import re
+from typing import Any, Union
+
+
+class SJSONSyntaxError(ValueError): ...
+
+
+@dataclass(frozen=True)
+class ItemFilter:
+    """Materialization path for lists, restricting materialization to items
+    that are dictionaries with any of the `lookups` key / value pairs."""
+    lookups: dict[str, set]
+
+    def matches(self, item: dict) -> bool:
+        for key, values in self.lookups.items():
+            try:
+                if item.get(key) in values:
+                    return True
+            except TypeError: # unhashable value
+                continue
+        return False
+
+
+Paths = Union[dict[str, Any], ItemFilter]
+# placeholder for list items filtered out by an `ItemFilter`
+SKIPPED = object()
+
+
+# whitespace and comments are insignificant anywhere between tokens (as with
+# `sjson`, a `*` within a comment consumes the character following it, so that
+# e.g. `/* a **/` is not closed)
+WHITESPACE_REGEX = re.compile(r'(?:[ \t\n\r]+|//[^\n]*|/\*(?:[^*]|\*[^/])*\*/)*')
+IDENTIFIER_REGEX = re.compile(r'[A-Za-z0-9_]*')
+QUOTED_STRING_REGEX = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"', re.DOTALL)
+# a raw string ends on the first `"""`, but up to two more quotes right after
+# it are still part of the string (e.g. `"""a""""` is `a"`)
+PYTHON_RAW_STRING_REGEX = re.compile(r'"""(.*?)"""("{0,2})', re.DOTALL)
+LUA_RAW_STRING_REGEX = re.compile(r'\[=\[(.*?)\]=\]', re.DOTALL)
+ESCAPE_REGEX = re.compile(r'\\(.)', re.DOTALL)
+ESCAPES = {'b': '\b', 'n': '\n', 't': '\t', '\\': '\\', '"': '"'}
+# numbers (and by extension literals) extend up to the next separator
+SCALAR_REGEX = re.compile(r'[^ \t\n\r,\]}]+')
+LITERALS = {'true': True, 'false': False, 'null': None}
+# most entries and items are matched in one go along with their separator,
+# without backtracking: uncommon cases (e.g. raw strings) or syntax errors fall
+# back to parsing token by token
+WHITESPACE = r'(?:[ \t\n\r]+|//[^\n]*(?![^\n])|/\*(?:[^*]|\*[^/])*\*/)*'
+STRING = r'"(?!"")[^"\\]*(?:\\.[^"\\]*)*"'
+SEPARATOR = rf'{WHITESPACE}(?:,{WHITESPACE})?'
+VALUE = rf'(?:(?:(?P<string>{STRING})|(?P<scalar>[^ \t\n\r,\]}}"\[{{/=:][^ \t\n\r,\]}}]*)){SEPARATOR}|(?P<open>\{{|\[(?!=)))'
+ENTRY_REGEX = re.compile(rf"""{WHITESPACE}(?:
+    (?P<close>}})
+    | (?:(?P<quoted_key>{STRING})|(?![\["/ \t\n\r])(?P<key>[A-Za-z0-9_]*)(?![A-Za-z0-9_]))
+      {WHITESPACE}(?:[=:]{WHITESPACE})?{VALUE}
+)""", re.DOTALL | re.VERBOSE)
+ITEM_REGEX = re.compile(rf"""{WHITESPACE}(?:(?P<close>\])|{VALUE})""", re.DOTALL | re.VERBOSE)
+SEPARATOR_REGEX = re.compile(SEPARATOR)
+# when skipping over a subtree, only delimiters, strings and comments matter:
+# anything else is consumed in bulk
+SKIP_REGEX = re.compile(r'''
+    [^"\[\]{}/]+
+    | """.*?"""(?:"{0,2})
+    | "[^"\\]*(?:\\.[^"\\]*)*"
+    | \[=\[.*?\]=\]
+    | //[^\n]*
+    | /\*(?:[^*]|\*[^/])*\*/
+    | (?P<open>[\[{])
+    | (?P<close>[\]}])
+    | /
+''', re.DOTALL | re.VERBOSE)
+
+
+class SpannedDict(dict):
+    """`dict` also recording where its values and closing delimiter are located
+    in the source text, as well as its original values and skipped keys."""
+    spans: dict[str, tuple[int, int]]
+    originals: dict[str, Any]
+    skipped: set[str]
+    end: int
+
+
+class SpannedList(list):
+    """`list` also recording where its items are located in the source text, as
+    well as its original items."""
+    spans: list[tuple[int, int]]
+    originals: list[Any]
+
+
+def loads(text: str, paths: Paths=None, spans: bool=False) -> dict:
+    """Parse SJSON `text` into a `dict`, only materializing keys from `paths`
+    if provided (nested `dict` or `ItemFilter` values restricting their subtree
+    further). If `spans` is True, return `SpannedDict` and `SpannedList`."""
+    if not text:
+        __raise(text, 0, "Unexpected end of SJSON data")
+    # the root dictionary may or may not be delimited by braces
+    pos = 1 if text.startswith('{') else 0
+    data, _ = __parse_dict(text, pos, False, paths, spans)
+    return data
+
+
+def validate(text: str) -> None:
+    """Check that SJSON `text` can be parsed, without materializing it."""
+    loads(text, {})
+
+
+def __parse_dict(text: str, pos: int, delimited: bool, paths: dict[str, Any], spans: bool) -> tuple[dict, int]:
+    result = SpannedDict() if spans else {}
+    value_spans = {}
+    skipped = set()
+    end = closing = len(text)
+    while True:
+        match = ENTRY_REGEX.match(text, pos)
+        if match is None:
+            # slow path
+            pos = __skip_whitespace(text, pos)
+            if pos >= end:
+                if not delimited:
+                    break
+                __raise(text, pos, "Unexpected end of SJSON data")
+            if text[pos] == '}':
+                closing = pos
+                pos += 1
+                break
+            key, pos = __parse_key(text, pos)
+            pos = __skip_whitespace(text, pos)
+            if pos < end and text[pos] in '=:':
+                pos = __skip_whitespace(text, pos + 1)
+            value_start = pos
+            if paths is None or key in paths:
+                result[key], pos = __parse_value(text, pos, __get_sub_paths(paths, key), spans)
+            else:
+                pos = __skip_value(text, pos)
+                skipped.add(key)
+            value_spans[key] = (value_start, pos)
+            pos = SEPARATOR_REGEX.match(text, pos).end()
+        elif match.lastgroup == 'close':
+            closing = match.start('close')
+            pos = match.end()
+            break
+        else:
+            key = match.group('key')
+            if key is None:
+                key = __get_string(match.group('quoted_key'))
+            value_start = match.start(match.lastgroup)
+            if paths is None or key in paths:
+                result[key], value_end, pos = __get_value(text, match, __get_sub_paths(paths, key), spans)
+            elif match.lastgroup == 'open':
+                value_end = __skip_value(text, value_start)
+                pos = SEPARATOR_REGEX.match(text, value_end).end()
+                skipped.add(key)
+            else:
+                _, value_end, pos = __get_value(text, match, None, False)
+                skipped.add(key)
+            value_spans[key] = (value_start, value_end)
+    if spans:
+        result.spans = value_spans
+        result.originals = dict(result)
+        result.skipped = skipped
+        # new keys are inserted before the closing brace (if any)
+        result.end = closing
+    return result, pos
+
+
+def __get_sub_paths(paths: dict[str, Any], key: str) -> Paths:
+    if paths is None:
+        return None
+    sub_paths = paths[key]
+    return sub_paths if isinstance(sub_paths, (dict, ItemFilter)) else None
+
+
+def __parse_list(text: str, pos: int, item_filter: ItemFilter, spans: bool) -> tuple[list, int]:
+    result = SpannedList() if spans else []
+    item_spans = []
+    end = len(text)
+    while True:
+        match = ITEM_REGEX.match(text, pos)
+        if match is None:
+            # slow path
+            pos = __skip_whitespace(text, pos)
+            if pos >= end:
+                __raise(text, pos, "Unexpected end of SJSON data")
+            if text[pos] == ']':
+                pos += 1
+                break
+            value_start = pos
+            if item_filter is None:
+                value, value_end = __parse_value(text, pos, None, spans)
+            else:
+                value, value_end = __parse_filtered_item(text, pos, item_filter, spans)
+            pos = SEPARATOR_REGEX.match(text, value_end).end()
+        elif match.lastgroup == 'close':
+            pos = match.end()
+            break
+        else:
+            value_start = match.start(match.lastgroup)
+            if item_filter is None:
+                value, value_end, pos = __get_value(text, match, None, spans)
+            else:
+                value, value_end = __parse_filtered_item(text, value_start, item_filter, spans)
+                pos = SEPARATOR_REGEX.match(text, value_end).end()
+        if item_filter is None or value is not SKIPPED:
+            result.append(value)
+            item_spans.append((value_start, value_end))
+    if spans:
+        result.spans = item_spans
+        result.originals = list(result)
+    return result, pos
+
+
+def __parse_filtered_item(text: str, pos: int, item_filter: ItemFilter, spans: bool) -> tuple[Any, int]:
+    if not text.startswith('{', pos):
+        return SKIPPED, __skip_value(text, pos)
+    # only materialize lookup keys at first, and only materialize the whole
+    # item if it matches
+    lookup_paths = dict.fromkeys(item_filter.lookups)
+    item, end = __parse_dict(text, pos + 1, True, lookup_paths, False)
+    if not item_filter.matches(item):
+        return SKIPPED, end
+    return __parse_dict(text, pos + 1, True, None, spans)
+
+
+def __get_value(text: str, match: re.Match, paths: Paths, spans: bool) -> tuple[Any, int, int]:
+    """Get value from an entry / item match, as well as positions after the
+    value and after its separator."""
+    kind = match.lastgroup
+    if kind == 'scalar':
+        scalar = match.group('scalar')
+        if scalar in LITERALS:
+            return LITERALS[scalar], match.end('scalar'), match.end()
+        elif scalar[0] in 'tfn':
+            # let the slow path handle literals directly followed by another
+            # token, and report invalid values
+            value, value_end = __parse_scalar(text, match.start('scalar'))
+        else:
+            try:
+                if '.' in scalar or 'e' in scalar or 'E' in scalar:
+                    return float(scalar), match.end('scalar'), match.end()
+                return int(scalar), match.end('scalar'), match.end()
+            except ValueError:
+                __raise(text, match.start('scalar'), f"Invalid value '{scalar}'")
+    elif kind == 'string':
+        return __get_string(match.group('string')), match.end('string'), match.end()
+    else:
+        value, value_end = __parse_value(text, match.start('open'), paths, spans)
+    return value, value_end, SEPARATOR_REGEX.match(text, value_end).end()
+
+
+def __get_string(string: str) -> str:
+    """Get string value from a quoted string token."""
+    if string.startswith('"""'):
+        match = PYTHON_RAW_STRING_REGEX.fullmatch(string)
+        return match.group(1) + match.group(2)
+    elif string.startswith('[=['):
+        return string[3:-3]
+    string = string[1:-1]
+    if '\\' in string:
+        string = ESCAPE_REGEX.sub(__unescape, string)
+    return string
+
+
+def __parse_value(text: str, pos: int, paths: Paths, spans: bool) -> tuple[Any, int]:
+    char = text[pos:pos + 1]
+    if char == '{':
+        return __parse_dict(text, pos + 1, True, paths if isinstance(paths, dict) else None, spans)
+    elif char == '[' and text[pos + 1:pos + 2] != '=':
+        return __parse_list(text, pos + 1, paths if isinstance(paths, ItemFilter) else None, spans)
+    elif char == '"' or char == '[':
+        return __parse_string(text, pos)
+    return __parse_scalar(text, pos)
+
+
+def __parse_key(text: str, pos: int) -> tuple[str, int]:
+    if text[pos] in '"[':
+        return __parse_string(text, pos)
+    match = IDENTIFIER_REGEX.match(text, pos)
+    return match.group(), match.end()
+
+
+def __parse_string(text: str, pos: int) -> tuple[str, int]:
+    if text.startswith('"""', pos):
+        match = PYTHON_RAW_STRING_REGEX.match(text, pos)
+    elif text.startswith('[=[', pos):
+        match = LUA_RAW_STRING_REGEX.match(text, pos)
+    elif text.startswith('"', pos):
+        match = QUOTED_STRING_REGEX.match(text, pos)
+    else:
+        __raise(text, pos, "Invalid quoted string, must start with '\"', '\"\"\"' or '[=['")
+    if match is None:
+        __raise(text, pos, "Unterminated string")
+    return __get_string(match.group()), match.end()
+
+
+def __unescape(match: re.Match) -> str:
+    # unknown escape sequences are kept as is
+    return ESCAPES.get(match.group(1), match.group())
+
+
+def __parse_scalar(text: str, pos: int) -> tuple[Any, int]:
+    match = SCALAR_REGEX.match(text, pos)
+    if not match:
+        __raise(text, pos, "Unexpected character" if pos < len(text) else "Unexpected end of SJSON data")
+    scalar = match.group()
+    for literal, value in LITERALS.items():
+        if scalar.startswith(literal):
+            # literals are not required to be followed by a separator
+            return value, pos + len(literal)
+    try:
+        if '.' in scalar or 'e' in scalar or 'E' in scalar:
+            return float(scalar), match.end()
+        return int(scalar), match.end()
+    except ValueError:
+        __raise(text, pos, f"Invalid value '{scalar}'")
+
+
+def __skip_value(text: str, pos: int) -> int:
+    char = text[pos:pos + 1]
+    if char == '"' or text.startswith('[=[', pos):
+        return __parse_string(text, pos)[1]
+    elif char != '{' and char != '[':
+        return __parse_scalar(text, pos)[1]
+    depth = 0
+    end = len(text)
+    while pos < end:
+        match = SKIP_REGEX.match(text, pos)
+        if not match:
+            __raise(text, pos, "Unterminated string")
+        pos = match.end()
+        if match.lastgroup == 'open':
+            depth += 1
+        elif match.lastgroup == 'close':
+            depth -= 1
+            if depth == 0:
+                return pos
+    __raise(text, pos, "Unexpected end of SJSON data")
+
+
+def __skip_whitespace(text: str, pos: int) -> int:
+    pos = WHITESPACE_REGEX.match(text, pos).end()
+    if text.startswith('/*', pos):
+        __raise(text, pos, "Could not find closing '*/' for comment")
+    return pos
+
+
+def __raise(text: str, pos: int, msg: str) -> None:
+    line = text.count('\n', 0, pos) + 1
+    column = pos - (text.rfind('\n', 0, pos) + 1) + 1
+    raise SJSONSyntaxError(f"{msg} at line {line}, column {column}")
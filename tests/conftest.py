@@ -0,0 +1,23 @@
+from pathlib import Path
+
+import pytest
+
+from hephaistos import config
+
+
+@pytest.fixture
+def hades_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Empty Hades directory, also used as working directory so that
+    `hephaistos-data` is created in it."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, 'hades_dir', tmp_path, raising=False)
+    monkeypatch.setattr(config, 'content_dir', tmp_path.joinpath('Content'), raising=False)
+    monkeypatch.setattr(config, 'force', False)
+    monkeypatch.setattr(config, 'paranoid', False)
+    monkeypatch.setattr(config, 'update_only', False)
+    monkeypatch.setattr(config, 'backup_store', None)
+    monkeypatch.setattr(config, 'backup_compression', 'none')
+    monkeypatch.setattr(config, 'delta_engine_backups', False)
+    # process everything in the current thread
+    monkeypatch.setattr(config, 'jobs', 1)
+    return tmp_path
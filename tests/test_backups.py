@@ -0,0 +1,144 @@
+import random
+import zipfile
+
+import pytest
+
+from hephaistos import backups, config, patchers
+
+
+def random_bytes(size: int, seed: int=0) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def patch(file, offsets: list[int], delta_backup: bool) -> None:
+    with patchers.transaction(), patchers.safe_patch_file(file, delta_backup=delta_backup) as (original_file, file):
+        data = bytearray(original_file.read_bytes())
+        for offset in offsets:
+            data[offset] ^= 0xff
+        patchers.write_file(file, bytes(data))
+
+
+def test_diff_merges_adjacent_ranges_across_chunks(monkeypatch):
+    monkeypatch.setattr(backups, 'DIFF_CHUNK_SIZE', 16)
+    monkeypatch.setattr(backups, 'DIFF_BISECT_SIZE', 4)
+    original = random_bytes(100)
+    patched = bytearray(original)
+    for offset in [3, 14, 15, 16, 17, 50, 99]:
+        patched[offset] ^= 0xff
+    assert backups.__diff(original, bytes(patched)) == [(3, 4), (14, 18), (50, 51), (99, 100)]
+
+
+def test_diff_identical():
+    original = random_bytes(1000)
+    assert backups.__diff(original, original) == []
+
+
+def test_rebuild_from_delta(hades_dir):
+    file = hades_dir.joinpath('engine.dll')
+    original = random_bytes(3 * 1024 * 1024)
+    file.write_bytes(original)
+    patch(file, [10, 2 * 1024 * 1024], delta_backup=True)
+    assert backups.is_delta(file)
+    assert not list(hades_dir.joinpath('hephaistos-data', 'backups').rglob('objects/*/*'))
+    backup_file = backups.get(file)
+    assert backup_file.read_bytes() == original
+    backups.release(backup_file)
+
+
+def test_rebuild_from_delta_of_modified_file(hades_dir):
+    file = hades_dir.joinpath('engine.dll')
+    file.write_bytes(random_bytes(4096))
+    patch(file, [10], delta_backup=True)
+    file.write_bytes(random_bytes(4096, seed=1))
+    with pytest.raises(LookupError):
+        backups.get(file)
+
+
+def test_delta_backup_is_updated_without_option(hades_dir):
+    file = hades_dir.joinpath('engine.dll')
+    original = random_bytes(4096)
+    file.write_bytes(original)
+    patch(file, [10], delta_backup=True)
+    # repatching at other offsets without the option must not leave a delta
+    # backup missing the original bytes at these offsets
+    patch(file, [2000, 3000], delta_backup=False)
+    assert backups.is_delta(file)
+    backups.restore()
+    assert file.read_bytes() == original
+
+
+def test_restore_keeps_backups_of_files_that_cannot_be_restored(hades_dir):
+    engine_file = hades_dir.joinpath('engine.dll')
+    other_file = hades_dir.joinpath('other.dll')
+    engine_file.write_bytes(random_bytes(4096))
+    other_original = random_bytes(4096, seed=1)
+    other_file.write_bytes(other_original)
+    patch(engine_file, [10], delta_backup=True)
+    patch(other_file, [10], delta_backup=False)
+    engine_file.unlink()
+    backups.restore()
+    assert other_file.read_bytes() == other_original
+    assert not engine_file.exists()
+    assert backups.is_delta(engine_file)
+    assert not backups.exists(other_file)
+
+
+def use_installation(installation_dir, monkeypatch):
+    installation_dir.mkdir(exist_ok=True)
+    monkeypatch.chdir(installation_dir)
+    monkeypatch.setattr(config, 'hades_dir', installation_dir)
+
+
+def test_shared_backups_are_discarded_once_unused(hades_dir, monkeypatch):
+    shared_store = hades_dir.joinpath('shared')
+    monkeypatch.setattr(config, 'backup_store', shared_store)
+    original = random_bytes(4096)
+    installations = [hades_dir.joinpath('first'), hades_dir.joinpath('second')]
+    for installation_dir in installations:
+        use_installation(installation_dir, monkeypatch)
+        installation_dir.joinpath('engine.dll').write_bytes(original)
+        patch(installation_dir.joinpath('engine.dll'), [10], delta_backup=False)
+    objects = list(shared_store.rglob('objects/*/*'))
+    assert len(objects) == 1
+    use_installation(installations[0], monkeypatch)
+    backups.restore()
+    assert objects[0].exists()
+    use_installation(installations[1], monkeypatch)
+    backups.restore()
+    assert not objects[0].exists()
+    assert installations[1].joinpath('engine.dll').read_bytes() == original
+
+
+def test_shared_backups_are_discarded_once_replaced(hades_dir, monkeypatch):
+    monkeypatch.setattr(config, 'backup_store', hades_dir.joinpath('shared'))
+    file = hades_dir.joinpath('engine.dll')
+    file.write_bytes(random_bytes(4096))
+    patch(file, [10], delta_backup=False)
+    # e.g. game update
+    file.write_bytes(random_bytes(4096, seed=1))
+    monkeypatch.setattr(config, 'force', True)
+    patch(file, [10], delta_backup=False)
+    assert [object_file.name for object_file in hades_dir.joinpath('shared').rglob('objects/*/*')] == [backups.digest(file)]
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_archived_backups_are_discarded_once_replaced(hades_dir, monkeypatch, shared):
+    backup_store = hades_dir.joinpath('shared') if shared else hades_dir.joinpath('hephaistos-data', 'backups')
+    if shared:
+        monkeypatch.setattr(config, 'backup_store', backup_store)
+    monkeypatch.setattr(config, 'backup_compression', backups.BackupCompression.ZLIB)
+    files = [hades_dir.joinpath('engine.dll'), hades_dir.joinpath('other.dll')]
+    for seed, file in enumerate(files):
+        file.write_bytes(random_bytes(4096, seed))
+        patch(file, [10], delta_backup=False)
+    # e.g. game update
+    updated = random_bytes(4096, seed=2)
+    files[0].write_bytes(updated)
+    monkeypatch.setattr(config, 'force', True)
+    patch(files[0], [10], delta_backup=False)
+    with zipfile.ZipFile(backup_store.joinpath(backups.ARCHIVE_FILE)) as archive:
+        assert sorted(archive.namelist()) == sorted(backups.digest(file) for file in files)
+    backups.restore()
+    assert files[0].read_bytes() == updated
+    assert files[1].read_bytes() == random_bytes(4096, 1)
+    assert not backup_store.joinpath(backups.ARCHIVE_FILE).exists()
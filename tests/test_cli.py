@@ -0,0 +1,82 @@
+from pathlib import Path
+import struct
+
+import pytest
+
+import hephaistos
+from hephaistos import backups, cli, config, lua_mod, patch_state, patchers
+from hephaistos.helpers import HUD, Platform, Scaling
+
+
+ENGINES = {
+    patchers.Engine.DIRECTX64: 'x64/EngineWin64s.dll',
+    patchers.Engine.VULKAN: 'x64Vk/EngineWin64sv.dll',
+}
+SJSON_FILE = 'Content/Game/GUI/Test.sjson'
+
+
+def floats(*values: float) -> bytes:
+    return struct.pack(f'<{len(values)}f', *values)
+
+
+def engine(version: int) -> bytes:
+    # a single match of each hex patch (expected counts are only warned about)
+    return bytes(version) + b'\xc7\x05....\x80\x07\x00\x00\xc7\x05....\x38\x04\x00\x00' + floats(0, 1920, 1080, 0, 960, 540, 0, 1080, 1440, 1632, 1920)
+
+
+@pytest.fixture
+def patched(hades_dir, monkeypatch):
+    """Hades patched with engine and SJSON files standing in for actual ones."""
+    monkeypatch.setattr(config, 'platform', Platform.WINDOWS)
+    monkeypatch.setitem(patchers.ENGINES, Platform.WINDOWS, ENGINES)
+    monkeypatch.setattr(patchers, 'SJON_PATCHES', {'GUI': {'Test.sjson': {'Screen': {'Width': lambda data: config.new_screen.width}}}})
+    monkeypatch.setattr(config, 'MOD_SOURCE_DIR', Path(hephaistos.__file__).parent.parent.joinpath(config.HEPHAISTOS_DATA_DIR, 'lua'))
+    monkeypatch.setattr(config, 'modimporter', None)
+    for name in ['center_hud', 'custom_resolution']:
+        monkeypatch.setattr(config, name, getattr(config, name))
+    for filepath in ENGINES.values():
+        hades_dir.joinpath(filepath).parent.mkdir(parents=True)
+        hades_dir.joinpath(filepath).write_bytes(engine(0))
+    hades_dir.joinpath(SJSON_FILE).parent.mkdir(parents=True)
+    hades_dir.joinpath(SJSON_FILE).write_text('Screen = { Width = 1920 }\n')
+    hook_file = config.content_dir.joinpath(lua_mod.LUA_SCRIPTS_DIR, 'RoomManager.lua')
+    hook_file.parent.mkdir(parents=True)
+    hook_file.write_text('-- RoomManager\n')
+    cli.PatchSubcommand().handler(3440, 1440, Scaling.HOR_PLUS, HUD.EXPAND, custom_resolution=False, force=False)
+    assert patch_state.check(patch_state.get())
+    return hades_dir
+
+
+def get_files(hades_dir: Path) -> dict[str, tuple[int, bytes]]:
+    files = [hades_dir.joinpath(filepath) for filepath in [*ENGINES.values(), SJSON_FILE]]
+    return {file.relative_to(hades_dir).as_posix(): (file.stat().st_mtime_ns, file.read_bytes()) for file in files}
+
+
+def get_contents(files: dict[str, tuple[int, bytes]]) -> dict[str, bytes]:
+    return {filepath: content for filepath, (_, content) in files.items()}
+
+
+@pytest.mark.parametrize('updated_file, original', [
+    (ENGINES[patchers.Engine.DIRECTX64], engine(16)),
+    (SJSON_FILE, b'Screen = { Width = 1920 Height = 1080 }\n'),
+])
+def test_update(patched, updated_file, original):
+    files = get_files(patched)
+    patched_files = get_contents(files)
+    # simulate a game update replacing a patched file
+    patched.joinpath(updated_file).write_bytes(original)
+    cli.UpdateSubcommand(cli.PatchSubcommand()).handler()
+    assert patch_state.check(patch_state.get())
+    updated_files = get_files(patched)
+    for filepath in files:
+        if filepath == updated_file:
+            assert updated_files[filepath][1] not in (original, patched_files[filepath])
+        else:
+            # files which were not modified are left untouched
+            assert updated_files[filepath] == files[filepath]
+    backup_file = backups.get(patched.joinpath(updated_file))
+    assert backup_file.read_bytes() == original
+    backups.release(backup_file)
+    # updated file was repatched from its new original
+    cli.PatchSubcommand().handler(3440, 1440, Scaling.HOR_PLUS, HUD.EXPAND, custom_resolution=False, force=True)
+    assert get_contents(get_files(patched)) == get_contents(updated_files)
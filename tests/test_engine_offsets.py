@@ -0,0 +1,81 @@
+import logging
+import re
+
+import pytest
+
+from hephaistos import backups, config, engine_offsets, patchers
+
+
+OFFSETS = {'viewport': [[16, 4], [64, 4]]}
+
+
+@pytest.fixture
+def engine(hades_dir):
+    file = hades_dir.joinpath('x64', 'EngineWin64s.dll')
+    file.parent.mkdir()
+    file.write_bytes(bytes(32) + b'ABcD' + bytes(32) + b'ABeD' + bytes(32))
+    return file
+
+
+def test_get(engine):
+    engine_offsets.store(engine, 'sha256', OFFSETS)
+    assert engine_offsets.get(engine, 'sha256') == OFFSETS
+
+
+def test_get_missing(engine):
+    assert engine_offsets.get(engine, 'sha256') is None
+
+
+def test_get_after_game_update(engine):
+    engine_offsets.store(engine, 'sha256', OFFSETS)
+    assert engine_offsets.get(engine, 'other') is None
+
+
+def test_get_after_hephaistos_update(engine, monkeypatch):
+    engine_offsets.store(engine, 'sha256', OFFSETS)
+    monkeypatch.setattr(config, 'VERSION', 'other')
+    assert engine_offsets.get(engine, 'sha256') is None
+
+
+@pytest.mark.parametrize('content', ['{"version": "', '{}', '[]', '{"version": "%(version)s", "sha256": "sha256", "offsets": []}'])
+def test_get_corrupted(engine, content):
+    offsets_file = engine_offsets.store(engine, 'sha256', OFFSETS)
+    offsets_file.write_text(content % {'version': config.VERSION})
+    assert engine_offsets.get(engine, 'sha256') is None
+
+
+HEX_PATCHES = {
+    'test': {
+        'pattern': re.compile(rb'AB(.)D'),
+        'replacement': rb'XY\g<1>Z',
+        'replacement_args': (),
+        'expected_subs': 2,
+    },
+}
+
+
+def patch_engine(file) -> bool:
+    with patchers.transaction(), patchers.safe_patch_file(file) as (original_file, file):
+        return patchers.__patch_engine(original_file, file, 'test', HEX_PATCHES)
+
+
+def test_patch_engine_reuses_offsets(engine, monkeypatch, caplog):
+    assert patch_engine(engine)
+    patched = engine.read_bytes()
+    assert patched == bytes(32) + b'XYcZ' + bytes(32) + b'XYeZ' + bytes(32)
+    def scan_engine(*args):
+        raise AssertionError("engine should not be scanned again")
+    monkeypatch.setattr(patchers, '__scan_engine', scan_engine)
+    with caplog.at_level(logging.DEBUG, logger=config.LOGGER.name):
+        assert patch_engine(engine)
+    assert "Reusing engine offsets" in caplog.text
+    assert engine.read_bytes() == patched
+
+
+def test_patch_engine_after_offsets_are_corrupted(engine):
+    assert patch_engine(engine)
+    patched = engine.read_bytes()
+    engine_offsets.__get_file(engine).write_bytes(b'{"ver')
+    assert patch_engine(engine)
+    assert engine.read_bytes() == patched
+    assert engine_offsets.get(engine, backups.digest(engine)) == {'test': [[32, 4], [68, 4]]}
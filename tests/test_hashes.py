@@ -0,0 +1,29 @@
+import hashlib
+import os
+
+from hephaistos import config, hashes, patchers
+
+
+def test_digest_of_file_rewritten_within_timestamp_resolution(hades_dir):
+    file = hades_dir.joinpath('file.txt')
+    file.write_text('before')
+    stat = file.stat()
+    assert hashes.digest(file) == hashlib.sha256(b'before').hexdigest()
+    with patchers.transaction():
+        patchers.write_file(file, 'after!')
+    # e.g. on FAT, where modification times have a 2 seconds resolution
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert hashes.digest(file) == hashlib.sha256(b'after!').hexdigest()
+
+
+def test_check_without_refresh(hades_dir):
+    file = hades_dir.joinpath('file.txt')
+    file.write_text('content')
+    hashes.store(file)
+    manifest = config.HASHES_FILE.read_bytes()
+    stat = file.stat()
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert hashes.check(file, refresh=False)
+    assert config.HASHES_FILE.read_bytes() == manifest
+    assert hashes.check(file)
+    assert config.HASHES_FILE.read_bytes() != manifest
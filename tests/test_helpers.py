@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from hephaistos import config, helpers, patchers
+from hephaistos.helpers import Platform, Scaling
+
+
+MANIFEST_VERSION = 1
+
+
+def update_manifest(file: Path, worker: int) -> None:
+    for index in range(20):
+        helpers.update_manifest(file, MANIFEST_VERSION, {f'{worker}-{index}': {'worker': worker}}, removed=[f'{worker}-{index - 1}'])
+
+
+def test_update_manifest_concurrently(tmp_path):
+    file = tmp_path.joinpath('manifest.json')
+    helpers.update_manifest(file, MANIFEST_VERSION, {'initial': {}})
+    with ProcessPoolExecutor(4) as executor:
+        list(executor.map(update_manifest, [file] * 4, range(4)))
+    assert helpers.load_manifest(file, MANIFEST_VERSION) == {
+        'initial': {},
+        **{f'{worker}-19': {'worker': worker} for worker in range(4)},
+    }
+
+
+PROFILE = 'X = 1920\nY = 1080\nWindowWidth = 1920\nWindowHeight = 1080\nWindowX = 0\nWindowY = 0\n'
+
+
+@pytest.fixture
+def ms_store_save_dir(hades_dir, monkeypatch):
+    """Microsoft Store save directory holding a profile and a binary save file,
+    both with random names in random sub-directories."""
+    save_dir = hades_dir.joinpath('wgs')
+    profile = save_dir.joinpath('0A1B', '2C3D', '4E5F')
+    profile.parent.mkdir(parents=True)
+    profile.write_text(PROFILE)
+    save = save_dir.joinpath('0A1B', '6A7B', '8C9D')
+    save.parent.mkdir(parents=True)
+    save.write_bytes(b'SGB1\0' + bytes(range(256)) * 16)
+    monkeypatch.setattr(config, 'platform', Platform.MS_STORE)
+    monkeypatch.setitem(helpers.TRY_SAVE_DIR, Platform.MS_STORE, lambda: [save_dir])
+    return save_dir
+
+
+def test_ms_store_profiles_are_still_cached_after_patching(ms_store_save_dir, monkeypatch):
+    monkeypatch.setattr(config, 'custom_resolution', True)
+    helpers.configure_screen_variables(3440, 1440, Scaling.HOR_PLUS)
+    profiles = helpers.try_get_profile_sjson_files()
+    patchers.patch_profile_sjsons()
+    assert 'X = 3440' in profiles[0].read_text()
+    assert helpers.__load_ms_store_profiles(ms_store_save_dir) == profiles
+
+
+def forbid_walk(monkeypatch: pytest.MonkeyPatch) -> None:
+    def rglob(self, pattern):
+        raise AssertionError("save directory should not be walked")
+    monkeypatch.setattr(Path, 'rglob', rglob)
+
+
+def test_find_ms_store_profiles(ms_store_save_dir):
+    invalid = ms_store_save_dir.joinpath('0A1B', '6A7B', 'AAAA')
+    invalid.write_text('X = {')
+    large = ms_store_save_dir.joinpath('0A1B', '6A7B', 'BBBB')
+    large.write_text(PROFILE + ' ' * helpers.PROFILE_MAX_SIZE)
+    ms_store_save_dir.joinpath('0A1B', '2C3D', '4E5F' + config.TEMPORARY_SUFFIX).write_text(PROFILE)
+    assert helpers.try_get_profile_sjson_files() == [ms_store_save_dir.joinpath('0A1B', '2C3D', '4E5F')]
+
+
+def test_find_cached_ms_store_profiles(ms_store_save_dir, monkeypatch):
+    profiles = helpers.try_get_profile_sjson_files()
+    # profiles may be modified by the game without invalidating the cache
+    profiles[0].write_text(PROFILE.replace('1920', '2560'))
+    with monkeypatch.context() as m:
+        forbid_walk(m)
+        assert helpers.try_get_profile_sjson_files() == profiles
+
+
+def test_find_ms_store_profiles_after_directory_change(ms_store_save_dir):
+    profiles = helpers.try_get_profile_sjson_files()
+    profile = ms_store_save_dir.joinpath('0A1B', 'FFFF', 'FFFF')
+    profile.parent.mkdir()
+    profile.write_text(PROFILE)
+    assert sorted(helpers.try_get_profile_sjson_files()) == sorted(profiles + [profile])
+    profile.unlink()
+    assert helpers.try_get_profile_sjson_files() == profiles
+
+
+def test_refresh_ms_store_profiles(ms_store_save_dir, monkeypatch):
+    profiles = helpers.try_get_profile_sjson_files()
+    directory = profiles[0].parent
+    mtime_ns = directory.stat().st_mtime_ns
+    directory.joinpath('new').write_text(PROFILE)
+    # only directories left as they were when cached are refreshed
+    helpers.refresh_ms_store_profiles({directory: mtime_ns - 1})
+    with pytest.raises(LookupError):
+        helpers.__load_ms_store_profiles(ms_store_save_dir)
+    helpers.refresh_ms_store_profiles({directory: mtime_ns})
+    with monkeypatch.context() as m:
+        forbid_walk(m)
+        assert helpers.try_get_profile_sjson_files() == profiles
@@ -0,0 +1,42 @@
+from pathlib import Path
+import shutil
+
+import pytest
+
+import hephaistos
+from hephaistos import config, helpers, lua_mod, patch_state
+from hephaistos.helpers import Scaling
+
+
+PARAMETERS = {'width': 2560, 'height': 1080}
+
+
+@pytest.fixture
+def installed_lua_mod(hades_dir, monkeypatch):
+    monkeypatch.setattr(config, 'MOD_SOURCE_DIR', Path(hephaistos.__file__).parent.parent.joinpath(config.HEPHAISTOS_DATA_DIR, 'lua'))
+    monkeypatch.setattr(config, 'modimporter', None)
+    helpers.configure_screen_variables(PARAMETERS['width'], PARAMETERS['height'], Scaling.HOR_PLUS)
+    hook_file = config.content_dir.joinpath(lua_mod.LUA_SCRIPTS_DIR, 'RoomManager.lua')
+    hook_file.parent.mkdir(parents=True)
+    hook_file.write_text('-- RoomManager\n')
+    shutil.copy2(hook_file, hades_dir.joinpath('RoomManager.lua.orig'))
+    lua_mod.install()
+    patch_state.store(PARAMETERS, lua_mod.get_installed_files())
+    return hook_file
+
+
+def test_check(installed_lua_mod):
+    assert patch_state.check(PARAMETERS)
+    assert not patch_state.check({**PARAMETERS, 'width': 3440})
+
+
+def test_check_after_hook_is_cleaned(installed_lua_mod, hades_dir):
+    # e.g. 'modimporter --clean' run outside of Hephaistos, restoring the hook
+    # file from its own backup along with its original modification time
+    shutil.copy2(hades_dir.joinpath('RoomManager.lua.orig'), installed_lua_mod)
+    assert not patch_state.check(PARAMETERS)
+
+
+def test_check_after_mod_file_is_removed(installed_lua_mod):
+    next(config.content_dir.joinpath(lua_mod.MOD_TARGET_DIR).glob('*.lua')).unlink()
+    assert not patch_state.check(PARAMETERS)
@@ -0,0 +1,330 @@
+from functools import partial
+import logging
+import mmap
+import os
+from pathlib import Path
+import random
+import struct
+import tempfile
+
+import pytest
+import sjson
+
+from hephaistos import backups, config, hashes, helpers, journal, patchers, sjson_parser
+from hephaistos.helpers import Scaling
+
+
+class Crash(Exception): ...
+
+
+def crash_after(monkeypatch: pytest.MonkeyPatch, count: int) -> None:
+    """Simulate a crash after moving `count` patched files into place."""
+    replace = os.replace
+    moved = []
+    def crashing_replace(source, destination):
+        if str(source).endswith(config.TEMPORARY_SUFFIX):
+            if len(moved) == count:
+                raise Crash()
+            moved.append(source)
+        replace(source, destination)
+    monkeypatch.setattr(os, 'replace', crashing_replace)
+
+
+def patch(file: Path, content: bytes, delta_backup: bool=False) -> None:
+    with patchers.transaction(), patchers.safe_patch_file(file, delta_backup=delta_backup) as (original_file, file):
+        patchers.write_file(file, content)
+
+
+def get_temporary_files(directory: Path) -> list[Path]:
+    return list(directory.rglob(f'*{config.TEMPORARY_SUFFIX}'))
+
+
+def test_write_file_leaves_identical_file_untouched(hades_dir):
+    file = hades_dir.joinpath('file.txt')
+    file.write_text('content')
+    mtime_ns = file.stat().st_mtime_ns
+    with patchers.transaction():
+        assert not patchers.write_file(file, 'content')
+        assert patchers.write_file(hades_dir.joinpath('other.txt'), 'content')
+    assert file.stat().st_mtime_ns == mtime_ns
+    assert hades_dir.joinpath('other.txt').read_text() == 'content'
+
+
+def test_transaction_rollback(hades_dir):
+    file = hades_dir.joinpath('file.txt')
+    file.write_text('original')
+    with pytest.raises(Crash):
+        with patchers.transaction():
+            patchers.write_file(file, 'patched')
+            raise Crash()
+    assert file.read_text() == 'original'
+    assert not get_temporary_files(hades_dir)
+
+
+@pytest.mark.parametrize('relative', [False, True])
+def test_recover_completes_interrupted_writes(hades_dir, monkeypatch, relative):
+    if relative:
+        monkeypatch.setattr(config, 'hades_dir', Path('.'))
+    files = [config.hades_dir.joinpath(f'{index}.txt') for index in range(3)]
+    for file in files:
+        file.write_text('original')
+    with monkeypatch.context() as m:
+        crash_after(m, 1)
+        with pytest.raises(Crash):
+            with patchers.transaction():
+                for file in files:
+                    patch(file, f'patched {file.name}'.encode())
+    assert [file.read_text() for file in files] == ['patched 0.txt', 'original', 'original']
+    assert journal.get()
+    patchers.recover()
+    assert [file.read_text() for file in files] == [f'patched {file.name}' for file in files]
+    assert all(hashes.check(file) for file in files)
+    assert not journal.get()
+    assert not get_temporary_files(hades_dir)
+
+
+def test_recover_discards_unjournaled_writes(hades_dir, monkeypatch):
+    file = hades_dir.joinpath('file.txt')
+    file.write_text('original')
+    def crashing_store(entries):
+        raise Crash()
+    with monkeypatch.context() as m:
+        m.setattr(journal, 'store', crashing_store)
+        with pytest.raises(Crash):
+            patch(file, b'patched')
+    assert get_temporary_files(hades_dir)
+    patchers.recover([hades_dir])
+    assert file.read_text() == 'original'
+    assert not get_temporary_files(hades_dir)
+
+
+def test_recover_with_delta_backup(hades_dir, monkeypatch):
+    file = hades_dir.joinpath('engine.dll')
+    original = random.Random(0).randbytes(4096)
+    file.write_bytes(original)
+    patch(file, original[:10] + b'\0' + original[11:], delta_backup=True)
+    # delta backup is updated before its file is moved into place
+    with monkeypatch.context() as m:
+        crash_after(m, 0)
+        with pytest.raises(Crash):
+            patch(file, original[:20] + b'\0' + original[21:])
+    patchers.recover()
+    assert file.read_bytes() == original[:20] + b'\0' + original[21:]
+    assert hashes.check(file)
+    backup_file = backups.get(file)
+    assert backup_file.read_bytes() == original
+    backups.release(backup_file)
+
+
+SJSON_TEXT = '''// header comment\r
+Screen = {\r
+  Width = 1920 // inline comment\r
+  Height = 1080\r
+  Unpatched = [ 1, 2 /* kept */ ]\r
+}\r
+Components = [\r
+  { Name = "A" X = 10 }\r
+  { Name = "B" X = 20 }\r
+]\r
+'''
+
+
+def patch_sjson(hades_dir: Path, patches: patchers.SJSONPatch) -> str:
+    original_file = hades_dir.joinpath('original.sjson')
+    original_file.write_bytes(SJSON_TEXT.encode())
+    file = hades_dir.joinpath('file.sjson')
+    with patchers.transaction():
+        assert patchers.__patch_sjson_file(original_file, file, patches)
+    return file.read_bytes().decode()
+
+
+def get_patched_data(patches: patchers.SJSONPatch) -> dict:
+    return patchers.__patch_sjson_data(sjson.loads(SJSON_TEXT), patches)
+
+
+def test_patch_sjson_file_splices_changes(hades_dir):
+    patches = {
+        'Screen': {
+            'Width': lambda data: data * 2,
+            'Height': lambda data: data,
+        },
+        'Components': [
+            partial(patchers.__upsert_siblings, 'Name', 'B', {
+                'X': (lambda value: value + 1, None),
+                'Y': (lambda value: value, 5),
+            }),
+        ],
+    }
+    expected = get_patched_data(patches)
+    text = patch_sjson(hades_dir, patches)
+    assert text == SJSON_TEXT.replace('1920', '3840').replace('X = 20 }', 'X = 21 \r\nY = 5\r\n}')
+    assert sjson_parser.loads(text) == expected
+
+
+def test_patch_sjson_file_serializes_unspliceable_changes(hades_dir):
+    patches = {'Screen': lambda data: {**data, 'Unpatched': [3]}}
+    expected = get_patched_data(patches)
+    text = patch_sjson(hades_dir, patches)
+    assert text == sjson.dumps(expected)
+
+
+def pe_image(sections: list[tuple[bytes, int, int]], size: int=0x1000) -> bytes:
+    data = bytearray(size)
+    data[:2] = b'MZ'
+    pe_offset = 0x80
+    struct.pack_into('<I', data, 0x3c, pe_offset)
+    data[pe_offset:pe_offset + 4] = patchers.PE_SIGNATURE
+    size_of_optional_header = 0xf0
+    struct.pack_into('<HH', data, pe_offset + 6, len(sections), 0)
+    struct.pack_into('<H', data, pe_offset + 20, size_of_optional_header)
+    for index, (name, offset, section_size) in enumerate(sections):
+        struct.pack_into('<8sIIII', data, pe_offset + 24 + size_of_optional_header + 40 * index, name, section_size, 0, section_size, offset)
+    return bytes(data)
+
+
+def macho_image(sections: list[tuple[bytes, int, int, int]], is_64_bit: bool=True, size: int=0x2000) -> bytes:
+    """Thin Mach-O image with a single segment holding `sections` (name, offset,
+    size, flags), preceded by an unrelated load command."""
+    data = bytearray(size)
+    header_size, segment_command, segment_size, section_size = (32, patchers.MACHO_LC_SEGMENT_64, 72, 80) if is_64_bit else (28, patchers.MACHO_LC_SEGMENT, 56, 68)
+    data[:4] = b'\xcf\xfa\xed\xfe' if is_64_bit else b'\xce\xfa\xed\xfe'
+    struct.pack_into('<I', data, 16, 2)
+    offset = header_size
+    struct.pack_into('<II', data, offset, 0x2, 24)
+    offset += 24
+    struct.pack_into('<II', data, offset, segment_command, segment_size + section_size * len(sections))
+    struct.pack_into('<I', data, offset + segment_size - 8, len(sections))
+    for index, (name, section_offset, size, flags) in enumerate(sections):
+        section_format = '<16s16sQQI12xI' if is_64_bit else '<16s16sIII12xI'
+        struct.pack_into(section_format, data, offset + segment_size + section_size * index, name, b'__TEXT', 0, size, section_offset, flags)
+    return bytes(data)
+
+
+def get_sections(data: bytes) -> patchers.Sections:
+    with tempfile.TemporaryFile() as file_handle:
+        file_handle.write(data)
+        file_handle.flush()
+        with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return patchers.__get_sections(mapped)
+
+
+def get_scan_ranges(data: bytes) -> list[tuple[int, int, set[str]]]:
+    hex_patches = {
+        'code': {'sections': patchers.CODE_SECTIONS},
+        'data': {'sections': patchers.DATA_SECTIONS},
+        'both': {'sections': patchers.CODE_SECTIONS + patchers.DATA_SECTIONS},
+        'any': {},
+    }
+    with tempfile.TemporaryFile() as file_handle:
+        file_handle.write(data)
+        file_handle.flush()
+        with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return [(start, end, set(targeting)) for start, end, targeting in patchers.__get_scan_ranges(mapped, hex_patches)]
+
+
+def test_get_pe_sections():
+    data = pe_image([(b'.text', 0x400, 0x200), (b'.rdata', 0x600, 0x100), (b'.reloc', 0x700, 0x80)])
+    assert get_sections(data) == {'.text': [(0x400, 0x600)], '.rdata': [(0x600, 0x700)], '.reloc': [(0x700, 0x780)]}
+    assert get_scan_ranges(data) == [
+        (0, 0x1000, {'any'}),
+        (0x400, 0x600, {'code', 'both'}),
+        (0x600, 0x700, {'data', 'both'}),
+    ]
+
+
+@pytest.mark.parametrize('is_64_bit', [True, False])
+def test_get_macho_sections(is_64_bit):
+    data = macho_image([(b'__text', 0x1000, 0x100, 0), (b'__const', 0x1100, 0x40, 0), (b'__bss', 0, 0x400, 0x1)], is_64_bit)
+    assert get_sections(data) == {'__text': [(0x1000, 0x1100)], '__const': [(0x1100, 0x1140)]}
+    assert get_scan_ranges(data) == [
+        (0, 0x2000, {'any'}),
+        (0x1000, 0x1100, {'code', 'both'}),
+        (0x1100, 0x1140, {'data', 'both'}),
+    ]
+
+
+def test_get_fat_macho_sections():
+    slices = [macho_image([(b'__text', 0x100, 0x80, 0)], size=0x200), macho_image([(b'__text', 0x100, 0x40, 0)], size=0x200)]
+    data = bytearray(0x3000)
+    data[:8] = patchers.MACHO_FAT_MAGIC + struct.pack('>I', len(slices))
+    for index, macho in enumerate(slices):
+        offset = 0x1000 * (index + 1)
+        struct.pack_into('>iiIII', data, 8 + 20 * index, 0, 0, offset, len(macho), 12)
+        data[offset:offset + len(macho)] = macho
+    assert get_sections(bytes(data)) == {'__text': [(0x1100, 0x1180), (0x2100, 0x2140)]}
+    # hex patches targeting only sections not found in the engine are matched
+    # against the whole file
+    assert get_scan_ranges(bytes(data)) == [
+        (0, len(data), {'data', 'any'}),
+        (0x1100, 0x1180, {'code', 'both'}),
+        (0x2100, 0x2140, {'code', 'both'}),
+    ]
+
+
+@pytest.mark.parametrize('data', [
+    bytes(0x100), # unknown format
+    b'MZ' + bytes(0x20), # truncated PE header
+    b'MZ' + bytes(0x3a) + b'\x40\0\0\0' + bytes(0x40), # missing PE signature
+    b'\xcf\xfa\xed\xfe' + bytes(8), # truncated Mach-O header
+])
+def test_get_sections_fallback(data):
+    assert get_sections(data) is None
+    assert get_scan_ranges(data) == [(0, len(data), {'code', 'data', 'both', 'any'})]
+
+
+def scan_engine(data: bytes) -> tuple[bytes, dict[str, int]]:
+    hex_patches = patchers.__get_engine_specific_hex_patches(patchers.Engine.DIRECTX64)
+    replacements = {hex_patch_name: hex_patch['replacement'] % hex_patch['replacement_args'] for hex_patch_name, hex_patch in hex_patches.items()}
+    with tempfile.TemporaryFile() as file_handle:
+        file_handle.write(data)
+        file_handle.flush()
+        with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            matches = patchers.__scan_engine(mapped, hex_patches, replacements)
+    patched = bytearray(data)
+    for hex_patch_matches in matches.values():
+        for offset, patched_bytes in hex_patch_matches:
+            patched[offset:offset + len(patched_bytes)] = patched_bytes
+    return bytes(patched), {hex_patch_name: len(hex_patch_matches) for hex_patch_name, hex_patch_matches in matches.items()}
+
+
+def subn_engine(data: bytes) -> tuple[bytes, dict[str, int]]:
+    """Apply hex patches one after the other, as Hephaistos used to."""
+    counts = {}
+    for hex_patch_name, hex_patch in patchers.__get_engine_specific_hex_patches(patchers.Engine.DIRECTX64).items():
+        data, counts[hex_patch_name] = hex_patch['pattern'].subn(hex_patch['replacement'] % hex_patch['replacement_args'], data)
+    return data, counts
+
+
+def floats(*values: float) -> bytes:
+    return struct.pack(f'<{len(values)}f', *values)
+
+
+@pytest.mark.parametrize('width, height, scaling', [(3440, 1440, Scaling.HOR_PLUS), (1280, 1024, Scaling.VERT_PLUS)])
+@pytest.mark.parametrize('engine', [
+    # distinct matches of all hex patches
+    b'\xc7\x05....\x80\x07\x00\x00\xc7\x05....\x38\x04\x00\x00' + floats(0, 1920, 1080, 0, 960, 540, 0, 1080, 1440, 1632, 1920),
+    # adjacent matches
+    floats(1920, 1080, 960, 540, 1920, 1080, 1920, 1080, 1440, 1632, 1920, 960, 540),
+    # overlapping matches: 'width_height_floats' ending with 'fullscreen_vector'
+    floats(0, 1080, 1440, 1632, 1920, 1080, 0),
+    # overlapping matches: 'fullscreen_vector' ending with 'width_height_floats'
+    floats(0, 1920, 1080, 1440, 1632, 1920, 0),
+])
+def test_scan_engine(engine, width, height, scaling):
+    helpers.configure_screen_variables(width, height, scaling)
+    patchers.__configure_hex_patches()
+    assert scan_engine(engine) == subn_engine(engine)
+
+
+def test_patch_sjson_data_warns_about_missing_lookup_values(caplog):
+    data = {'Components': [{'Name': 'A', 'X': 10}, {'Name': 'B', 'X': 20}, {'X': 30}]}
+    patches = {
+        'Components': [
+            partial(patchers.__upsert_siblings, 'Name', name, {'X': (lambda value: value + 1, None)})
+            for name in ['A', 'Missing', 'B']
+        ],
+    }
+    with caplog.at_level(logging.WARNING, logger=config.LOGGER.name):
+        patched = patchers.__patch_sjson_data(data, patches)
+    assert patched == {'Components': [{'Name': 'A', 'X': 11}, {'Name': 'B', 'X': 21}, {'X': 30}]}
+    assert [record.getMessage() for record in caplog.records] == ["Did not find 'Name = Missing' in 'Components.[]'"]
@@ -0,0 +1,80 @@
+from pathlib import Path
+
+import pytest
+
+import hephaistos
+from hephaistos import config, helpers, journal, lua_mod, patch_state, patchers, resolution_profiles
+from hephaistos.helpers import HUD, Platform, Scaling
+
+
+PARAMETERS = {
+    'wide': {'width': 3440, 'height': 1440, 'scaling': Scaling.HOR_PLUS, 'hud': HUD.EXPAND, 'custom_resolution': False},
+    'narrow': {'width': 1280, 'height': 800, 'scaling': Scaling.HOR_PLUS, 'hud': HUD.EXPAND, 'custom_resolution': False},
+}
+
+
+class Crash(Exception): ...
+
+
+@pytest.fixture
+def profiles(hades_dir, monkeypatch):
+    """Hades patched for the 'wide' profile, with both profiles prepared. Only
+    the Lua mod is patched, as engine and SJSON files are not available."""
+    monkeypatch.setattr(config, 'platform', Platform.WINDOWS)
+    monkeypatch.setattr(patchers, 'ENGINES', {Platform.WINDOWS: {}})
+    monkeypatch.setattr(patchers, 'SJON_PATCHES', {})
+    monkeypatch.setattr(config, 'MOD_SOURCE_DIR', Path(hephaistos.__file__).parent.parent.joinpath(config.HEPHAISTOS_DATA_DIR, 'lua'))
+    monkeypatch.setattr(config, 'modimporter', None)
+    hook_file = config.content_dir.joinpath(lua_mod.LUA_SCRIPTS_DIR, 'RoomManager.lua')
+    hook_file.parent.mkdir(parents=True)
+    hook_file.write_text('-- RoomManager\n')
+    configure(PARAMETERS['wide'])
+    lua_mod.install()
+    patch_state.store(PARAMETERS['wide'], lua_mod.get_installed_files())
+    for name, parameters in PARAMETERS.items():
+        configure(parameters)
+        resolution_profiles.prepare(name, parameters)
+    return {name: get_mod_config(resolution_profiles.__get_dir(name).joinpath(resolution_profiles.FILES_DIR)) for name in PARAMETERS}
+
+
+def configure(parameters: dict) -> None:
+    helpers.configure_screen_variables(parameters['width'], parameters['height'], parameters['scaling'])
+
+
+def get_mod_config(directory: Path) -> str:
+    mod_dir = config.content_dir.joinpath(lua_mod.MOD_TARGET_DIR)
+    return directory.joinpath(mod_dir.relative_to(config.hades_dir), lua_mod.MOD_CONFIG_FILE).read_text()
+
+
+def assert_switched(name: str, mod_configs: dict[str, str]) -> None:
+    assert patch_state.get_resolution_profile() == name
+    assert patch_state.check(PARAMETERS[name])
+    assert get_mod_config(config.hades_dir) == mod_configs[name]
+
+
+def test_prepare_leaves_hades_untouched(profiles):
+    assert profiles['wide'] != profiles['narrow']
+    assert get_mod_config(config.hades_dir) == profiles['wide']
+    assert patch_state.check(PARAMETERS['wide'])
+
+
+def test_switch(profiles):
+    for name in ['narrow', 'wide', 'narrow', 'narrow']:
+        resolution_profiles.switch(name)
+        assert_switched(name, profiles)
+
+
+def test_switch_is_completed_on_next_run(profiles, monkeypatch):
+    store = journal.store
+    def crashing_store(entries):
+        store(entries)
+        raise Crash()
+    with monkeypatch.context() as m:
+        m.setattr(journal, 'store', crashing_store)
+        with pytest.raises(Crash):
+            resolution_profiles.switch('narrow')
+    assert get_mod_config(config.hades_dir) == profiles['wide']
+    patchers.recover(lua_mod.get_directories())
+    assert_switched('narrow', profiles)
+    resolution_profiles.switch('wide')
+    assert_switched('wide', profiles)
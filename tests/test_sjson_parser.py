@@ -0,0 +1,83 @@
+import re
+
+import pytest
+import sjson
+
+from hephaistos import sjson_parser
+from hephaistos.sjson_parser import ItemFilter, SJSONSyntaxError
+
+
+SAMPLES = [
+    'Key = "Value"',
+    '{ Key = "Value" }',
+    'A = 1 B = -2.5 C = 1e3 D = true E = false F = null',
+    'A: 1, B = 2, C 3',
+    '"Quoted Key" = "Escaped \\"quote\\"\\n\\t\\\\ and \\q"',
+    'Raw = """multi\nline "quoted" """ Lua = [=[raw ] string]=]',
+    'Quotes = """a""""',
+    '// line comment\nA = 1 /* block\ncomment */ B = [ 1 /* inline */, 2 // trailing\n ]',
+    'Nested = { List = [ { Name = "a" }, { Name = "b" Values = [ [], {} ] } ] }',
+    'EmptyString = "" Empty = {} EmptyList = []',
+    'Literals = [ true false null ]',
+]
+
+
+@pytest.mark.parametrize('text', SAMPLES)
+def test_loads(text):
+    assert sjson_parser.loads(text) == sjson.loads(text)
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_loads_dumps(indent):
+    data = sjson.loads(' '.join(SAMPLES[2:]))
+    assert sjson_parser.loads(sjson.dumps(data, indent=indent)) == data
+
+
+def test_loads_paths():
+    text = '''
+        Skipped = { A = [ "}", """]""", [=[{]=] /* } */ ] }
+        Partial = { Kept = 1 Skipped = { B = 2 } }
+        Whole = { C = 3 }
+        Items = [ { Name = "a" Value = 1 } { Name = "b" Value = 2 } "c" { Value = 3 } ]
+    '''
+    paths = {
+        'Partial': {'Kept': None},
+        'Whole': 'patch',
+        'Items': ItemFilter({'Name': {'b'}}),
+    }
+    assert sjson_parser.loads(text, paths) == {
+        'Partial': {'Kept': 1},
+        'Whole': {'C': 3},
+        'Items': [{'Name': 'b', 'Value': 2}],
+    }
+
+
+def test_loads_spans():
+    text = 'A = 1\nB = { C = "c" }\nD = [ 1, 2 ]\n'
+    data = sjson_parser.loads(text, {'B': None, 'D': None}, spans=True)
+    assert {key: text[start:end] for key, (start, end) in data.spans.items()} == {
+        'A': '1',
+        'B': '{ C = "c" }',
+        'D': '[ 1, 2 ]',
+    }
+    assert data.skipped == {'A'}
+    assert [text[start:end] for start, end in data['D'].spans] == ['1', '2']
+    assert text[data['B'].end] == '}'
+
+
+@pytest.mark.parametrize('text, message', [
+    ('', "Unexpected end of SJSON data at line 1, column 1"),
+    ('A = {\n B = 1', "Unexpected end of SJSON data at line 2, column 7"),
+    ('A = "unterminated', "Unterminated string at line 1, column 5"),
+    ('A = 1\nB = 1x', "Invalid value '1x' at line 2, column 5"),
+    ('A = /* unterminated', "Could not find closing '*/' for comment at line 1, column 5"),
+])
+def test_loads_syntax_error(text, message):
+    with pytest.raises(SJSONSyntaxError, match=re.escape(message)):
+        sjson_parser.loads(text)
+
+
+def test_validate():
+    sjson_parser.validate('A = { B = [ 1 ] }')
+    with pytest.raises(SJSONSyntaxError):
+        sjson_parser.validate('A = { B = [ 1 }')